@@ -0,0 +1,309 @@
+"""
+Offline benchmark for the Parkiet TTS handler.
+
+Builds a tiny, randomly-initialised DiaForConditionalGeneration and matching
+processor (DAC codec included) in a temp directory, then runs the real
+`handler.handler` on CPU over a set of representative workloads, with no
+network and no GPU. The audio is noise, but every stage of the pipeline —
+parsing, voice cloning, tokenisation, generation, codec decode, encoding —
+does the same work per token as with the real weights, just on a smaller model.
+
+Each workload is one variation away from a base job (batch of 4 medium
+texts, no voice, wav), so a change in one number points at one dimension:
+
+    batch_1 / batch_16      — batch size
+    short / long            — text length
+    voice_F1                — preset voice cloning (audio prompt prefix)
+    mp3 / flac / opus / pcm — output format
+
+Usage:
+    python bench.py                          # print JSON results to stdout
+    python bench.py --out before.json
+    python bench.py --out after.json --compare before.json
+    python bench.py --quick --only base,voice_F1
+
+The result cache is disabled, and every job is seeded so the same tokens are
+generated on every run and commit. Peak RSS is the process high-water mark
+after each workload, so it only ever grows across the run; workloads always
+run in the same order so the numbers stay comparable between commits.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SENTENCES = [
+    "Het regent al de hele dag in Amsterdam.",
+    "We nemen de trein van half negen naar Utrecht, als die tenminste rijdt.",
+    "Mijn oma bakt op zondag altijd appeltaart met veel kaneel.",
+    "Kun je even kijken of de deur van de schuur op slot zit?",
+    "De vergadering is verplaatst naar donderdagmiddag om drie uur.",
+    "Op het strand van Scheveningen was het gisteren erg druk.",
+]
+
+TEXT_CHARS = {"short": 40, "medium": 150, "long": 400}
+
+BASE = {"batch": 4, "length": "medium", "voice": None, "format": "wav"}
+
+WORKLOADS = {
+    "base": {},
+    "batch_1": {"batch": 1},
+    "batch_16": {"batch": 16},
+    "short": {"length": "short"},
+    "long": {"length": "long"},
+    "voice_F1": {"voice": "F1"},
+    "mp3": {"format": "mp3"},
+    "flac": {"format": "flac"},
+    "opus": {"format": "opus"},
+    "pcm": {"format": "pcm"},
+}
+
+PERCENTILES = (50, 90, 99)
+
+
+# ---------------------------------------------------------------------------
+# Tiny model
+# ---------------------------------------------------------------------------
+
+def build_tiny_model(path: str) -> None:
+    """
+    Save a randomly-initialised Dia model and processor to `path`.
+
+    The shapes that the handler depends on are kept as in the real model:
+    9 codebooks of 1024 codes with Dia's delay pattern, and a 44.1 kHz DAC
+    codec at 512 samples per frame (86 frames/s). Only the widths and depths
+    are shrunk.
+    """
+    import torch
+    from transformers import (
+        DacConfig,
+        DacModel,
+        DiaConfig,
+        DiaFeatureExtractor,
+        DiaForConditionalGeneration,
+        DiaProcessor,
+        DiaTokenizer,
+    )
+    from transformers.models.dia.configuration_dia import DiaDecoderConfig, DiaEncoderConfig
+
+    torch.manual_seed(0)
+    encoder = DiaEncoderConfig(
+        num_hidden_layers=2, hidden_size=64, intermediate_size=128,
+        num_attention_heads=4, num_key_value_heads=4, head_dim=16,
+    )
+    decoder = DiaDecoderConfig(
+        num_hidden_layers=2, hidden_size=64, intermediate_size=128,
+        num_attention_heads=4, num_key_value_heads=2, head_dim=16,
+        cross_num_attention_heads=4, cross_head_dim=16, cross_num_key_value_heads=4, cross_hidden_size=64,
+    )
+    config = DiaConfig(encoder_config=encoder, decoder_config=decoder, delay_pattern=[0, 8, 9, 10, 11, 12, 13, 14, 15])
+    model = DiaForConditionalGeneration(config)
+    # Sample like the real checkpoint does, so the sampling processors do their work
+    model.generation_config.do_sample = True
+    model.save_pretrained(path)
+
+    codec_path = os.path.join(path, "dac")
+    codec = DacModel(DacConfig(encoder_hidden_size=8, decoder_hidden_size=32, sampling_rate=44100))
+    codec.save_pretrained(codec_path)
+    DiaProcessor(DiaFeatureExtractor(sampling_rate=44100), DiaTokenizer(), codec).save_pretrained(path)
+
+    # Point the processor at the local codec instead of the Hub
+    config_path = os.path.join(path, "processor_config.json")
+    with open(config_path) as f:
+        processor_config = json.load(f)
+    processor_config["audio_tokenizer"]["audio_tokenizer_name_or_path"] = codec_path
+    with open(config_path, "w") as f:
+        json.dump(processor_config, f, indent=2)
+
+
+# ---------------------------------------------------------------------------
+# Workloads
+# ---------------------------------------------------------------------------
+
+def make_text(chars: int, offset: int) -> str:
+    """A speaker-tagged Dutch text of about `chars` characters."""
+    words: list[str] = []
+    i = offset
+    while sum(len(s) + 1 for s in words) < chars:
+        words.append(SENTENCES[i % len(SENTENCES)])
+        i += 1
+    return "[S1] " + " ".join(words)[:chars].rstrip()
+
+
+def make_job(spec: dict, max_new_tokens: int, seed: int) -> dict:
+    job_input = {
+        "texts": [make_text(TEXT_CHARS[spec["length"]], i) for i in range(spec["batch"])],
+        "max_new_tokens": max_new_tokens,
+        "output_format": spec["format"],
+        "seed": seed,
+        "metrics": True,
+    }
+    if spec["voice"]:
+        job_input["voice"] = spec["voice"]
+    return {"id": "bench", "input": job_input}
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    summary = {f"p{p}": round(float(np.percentile(values, p)), 4) for p in PERCENTILES}
+    summary["mean"] = round(float(np.mean(values)), 4)
+    return summary
+
+
+def run_workload(handler, spec: dict, args) -> dict:
+    job = make_job(spec, args.max_new_tokens, args.seed)
+    for _ in range(args.warmup):
+        handler.handler(job)
+
+    runs = []
+    for _ in range(args.repeats):
+        response = handler.handler(job)
+        if "error" in response:
+            raise RuntimeError(f"[{response['code']}] {response['error']}")
+        runs.append(response["metrics"])
+
+    stages = sorted({name for run in runs for name in run["stages_s"]})
+    total_s = sum(run["total_s"] for run in runs)
+    return {
+        "spec": spec,
+        "runs": len(runs),
+        "total_s": percentiles([run["total_s"] for run in runs]),
+        "stages_s": {name: percentiles([run["stages_s"].get(name, 0.0) for run in runs]) for name in stages},
+        "throughput": {
+            "items_per_s": round(spec["batch"] * len(runs) / total_s, 2),
+            "tokens_per_s": round(sum(run["generated_tokens"] for run in runs) / total_s, 1),
+            "audio_s_per_s": round(sum(run["audio_s"] for run in runs) / total_s, 3),
+        },
+        "peak_rss_mb": max(run["peak_host_mb"] for run in runs),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def environment() -> dict:
+    import torch
+    import transformers
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "machine": platform.machine(),
+    }
+
+
+def print_comparison(baseline: dict, results: dict) -> None:
+    """Print p50 total time and throughput against a previous run to stderr."""
+    print(f"{'workload':<12} {'p50 before':>11} {'p50 after':>10} {'change':>8} {'tok/s after':>12}", file=sys.stderr)
+    for name, result in results["workloads"].items():
+        before = baseline.get("workloads", {}).get(name)
+        after_s = result["total_s"]["p50"]
+        if before is None:
+            print(f"{name:<12} {'-':>11} {after_s:>10.3f} {'-':>8} {result['throughput']['tokens_per_s']:>12}", file=sys.stderr)
+            continue
+        before_s = before["total_s"]["p50"]
+        change = (after_s - before_s) / before_s * 100 if before_s else 0.0
+        print(
+            f"{name:<12} {before_s:>11.3f} {after_s:>10.3f} {change:>+7.1f}% {result['throughput']['tokens_per_s']:>12}",
+            file=sys.stderr,
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--repeats", type=int, default=5, help="Measured runs per workload (default: 5)")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured runs per workload (default: 1)")
+    parser.add_argument("--max-new-tokens", type=int, default=64, help="Audio tokens per item (default: 64)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--only", help="Comma-separated workload names to run")
+    parser.add_argument("--quick", action="store_true", help="2 repeats and 32 tokens, for a smoke test")
+    parser.add_argument("--model-dir", help="Reuse (or create) the tiny model here instead of a temp dir")
+    parser.add_argument("--out", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="Previous results JSON to print a p50 comparison against")
+    args = parser.parse_args()
+    if args.quick:
+        args.repeats, args.max_new_tokens = 2, 32
+
+    names = args.only.split(",") if args.only else list(WORKLOADS)
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workload(s) {unknown}; choose from {list(WORKLOADS)}")
+
+    with tempfile.TemporaryDirectory(prefix="parkiet-bench-") as tmp:
+        model_dir = args.model_dir or os.path.join(tmp, "model")
+        if not os.path.exists(os.path.join(model_dir, "config.json")):
+            build_tiny_model(model_dir)
+
+        # handler.py reads its configuration at import time
+        os.environ.update({
+            "MODEL_ID": model_dir,
+            "VOICES_DIR": os.environ.get("VOICES_DIR", os.path.join(HERE, "voices")),
+            "VOICE_STORE_DIR": os.path.join(tmp, "voice-store"),
+            "HF_HUB_OFFLINE": "1",
+            "RESULT_CACHE_SIZE": "0",
+            "RESULT_CACHE_DIR": "",
+            "TOKEN_LOG_PATH": "",
+            "AUDIO_DELIVERY": "inline",
+        })
+        # Claim the root logger first so handler's stdout logging stays out of the report
+        logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+        sys.path.insert(0, HERE)
+        started = time.perf_counter()
+        import handler
+        load_s = time.perf_counter() - started
+
+        results = {
+            "environment": environment(),
+            "config": {
+                "repeats": args.repeats,
+                "warmup": args.warmup,
+                "max_new_tokens": args.max_new_tokens,
+                "seed": args.seed,
+                "device": handler.DEVICE,
+                "dtype": str(handler.TORCH_DTYPE),
+            },
+            "startup_s": {"import": round(load_s, 3), **handler.STARTUP_TIMINGS},
+            "workloads": {},
+        }
+        for name in names:
+            spec = {**BASE, **WORKLOADS[name]}
+            print(f"Running {name}: {spec}", file=sys.stderr)
+            results["workloads"][name] = run_workload(handler, spec, args)
+        results["peak_rss_mb"] = max(w["peak_rss_mb"] for w in results["workloads"].values())
+
+    report = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Offline bulk renderer for JSONL manifests of TTS jobs.
+
+Each manifest line is a job, either in RunPod's shape ({"id": ..., "input":
+{...}}) or just the input object (with an optional "id"). Inputs are the
+same as the handler's (see `handler.handler`). Jobs without an id are
+named after their line number, so keep ids stable if the manifest is edited
+between runs.
+
+Texts are regrouped across the whole file. Items whose jobs share
+generation parameters, output format and voice (`handler.batch_key`) are
+merged and run through the regular pipeline (`handler.iter_results`) in
+groups of up to --group-items texts, which the handler then length-buckets
+into sub-batches. A group runs as soon as it is full, and whatever is left
+runs at the end of the file. Seeded items render the same as they would in
+their own job.
+
+Every clip is written to --out-dir as soon as it is encoded, as
+`<job id>_<index>.<format>`. Characters other than letters, digits and `._-`
+in the id are replaced, and a short hash of the id is added. Then one line is appended to the results JSONL:
+
+    {"id": "job-1", "index": 0, "path": "job-1_0.wav"}
+    {"id": "job-1", "index": 1, "error": "...", "code": "GPU_OOM"}
+
+With "delivery": "url" or "key" the line holds the URL or key instead of a
+path. The results file is also the checkpoint. A rerun with the same
+arguments skips every item that already has a result without an error, so
+an interrupted run picks up where it stopped and failed items are retried.
+
+Usage:
+    python bulk.py catalog.jsonl --out-dir renders/
+    python bulk.py catalog.jsonl --out-dir renders/ --group-items 512
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass, replace
+
+import handler
+from handler import AppError, JobMetrics, JobParams, logger
+
+_UNSAFE_FILENAME = re.compile(r'[^A-Za-z0-9._-]+')
+
+
+@dataclass
+class Item:
+    """One text of a manifest job, waiting in a group."""
+    job_id: str
+    index: int
+    text: str
+    seed: int | None
+    budget: int | None
+    features: tuple[int, int, int]
+
+
+@dataclass
+class Group:
+    """Compatible items from any number of jobs; `params` is the first job's."""
+    params: JobParams
+    items: list[Item]
+
+
+def clip_stem(job_id: str) -> str:
+    """A filename for the job's clips; ids that had to be changed get a hash, so they can't collide."""
+    safe = _UNSAFE_FILENAME.sub("_", job_id)
+    if safe != job_id:
+        safe += "-" + hashlib.sha256(job_id.encode("utf-8")).hexdigest()[:8]
+    return safe
+
+
+class BulkRun:
+    def __init__(self, out_dir: str, results_path: str, group_items: int):
+        self.out_dir = out_dir
+        self.results_path = results_path
+        self.group_items = group_items
+        self.done = self._read_done()
+        self.groups: dict[tuple, Group] = {}
+        self.counts = {"jobs": 0, "skipped": 0, "rendered": 0, "failed": 0}
+        self.audio_s = 0.0
+        os.makedirs(out_dir, exist_ok=True)
+        self._results = open(results_path, "a", encoding="utf-8")
+
+    def _read_done(self) -> set[tuple[str, int]]:
+        """Items with a successful result from an earlier run."""
+        done = set()
+        if not os.path.exists(self.results_path):
+            return done
+        with open(self.results_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by an interrupted run
+                if "error" not in record and record.get("index") is not None:
+                    done.add((record["id"], record["index"]))
+        if done:
+            logger.info(f"Resuming: {len(done)} item(s) already rendered in {self.results_path}")
+        return done
+
+    # ── Results ────────────────────────────────────────────────
+
+    def _record(self, record: dict) -> None:
+        self._results.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._results.flush()
+
+    def _write_clip(self, job_id: str, index: int, params: JobParams, entry: str) -> None:
+        record = {"id": job_id, "index": index}
+        if params.delivery == "inline":
+            name = f"{clip_stem(job_id)}_{index}.{params.output_format}"
+            path = os.path.join(self.out_dir, name)
+            with open(path + ".tmp", "wb") as f:
+                f.write(base64.b64decode(entry))
+            os.replace(path + ".tmp", path)
+            record["path"] = name
+        else:
+            record[params.delivery] = entry
+        self._record(record)
+        self.counts["rendered"] += 1
+
+    def _fail(self, job_id: str, index: int | None, error: AppError) -> None:
+        self._record({"id": job_id, "index": index, "error": error.message, "code": error.code})
+        self.counts["failed"] += 1
+
+    # ── Manifest ───────────────────────────────────────────────
+
+    def add_job(self, job_id: str, job_input: dict) -> None:
+        """Parse a job and queue its unfinished items; full groups run straight away."""
+        self.counts["jobs"] += 1
+        if not isinstance(job_input, dict):
+            self._fail(job_id, None, AppError("INVALID_INPUT", "Manifest line is not a JSON object."))
+            return
+        try:
+            params = handler.parse_input(job_input)
+            if params.long_form:
+                self._run_long_form(job_id, job_input)
+                return
+            handler.resolve_voice_cloning(params)
+        except AppError as e:
+            self._fail(job_id, None, e)
+            return
+
+        todo = [i for i in range(len(params.input_texts)) if (job_id, i) not in self.done]
+        self.counts["skipped"] += len(params.input_texts) - len(todo)
+        if not todo:
+            return
+
+        key = handler.batch_key(params)
+        group = self.groups.get(key)
+        if group is None:
+            # Only the first job's voice is kept: every job in the group shares it
+            params.audio_array = None
+            group = self.groups[key] = Group(params, [])
+        group.items.extend(
+            Item(
+                job_id=job_id,
+                index=i,
+                text=params.input_texts[i],
+                seed=params.seeds[i] if params.seeds is not None else None,
+                budget=params.token_budgets[i] if params.token_budgets is not None else None,
+                features=params.text_features[i],
+            )
+            for i in todo
+        )
+        if len(group.items) >= self.group_items:
+            self.run_group(self.groups.pop(key))
+
+    def flush(self) -> None:
+        while self.groups:
+            self.run_group(self.groups.pop(next(iter(self.groups))))
+
+    # ── Rendering ──────────────────────────────────────────────
+
+    def run_group(self, group: Group) -> None:
+        items = group.items
+        budgets = [item.budget for item in items] if group.params.token_budgets is not None else None
+        params = replace(
+            group.params,
+            input_texts=[item.text for item in items],
+            max_new_tokens=max(budgets) if budgets else group.params.max_new_tokens,
+            token_budgets=budgets,
+            text_features=[item.features for item in items],
+            seeds=[item.seed for item in items] if group.params.seeds is not None else None,
+            item_errors={},
+            cached_items=set(),
+            metrics=JobMetrics(),
+        )
+        jobs = len({item.job_id for item in items})
+        logger.info(f"Rendering {len(items)} text(s) from {jobs} job(s)")
+        started = time.perf_counter()
+        written = set()
+        try:
+            for i, entry in handler.iter_results(params):
+                self._write_clip(items[i].job_id, items[i].index, params, entry)
+                written.add(i)
+        except AppError as e:
+            params.item_errors.update((i, e) for i in range(len(items)) if i not in written | params.item_errors.keys())
+        for i, error in sorted(params.item_errors.items()):
+            self._fail(items[i].job_id, items[i].index, error)
+
+        audio_s = sum(params.metrics.item_audio_s.values())
+        self.audio_s += audio_s
+        elapsed = time.perf_counter() - started
+        logger.info(f"Rendered {audio_s:.1f}s of audio in {elapsed:.1f}s ({audio_s / elapsed:.2f}x real time)")
+
+    def _run_long_form(self, job_id: str, job_input: dict) -> None:
+        """Long-form jobs make one clip each and run on their own, through the handler."""
+        if (job_id, 0) in self.done:
+            self.counts["skipped"] += 1
+            return
+        response = handler.handler({"id": job_id, "input": job_input})
+        if "error" in response:
+            self._fail(job_id, 0, AppError(response["code"], response["error"]))
+            return
+        params = JobParams(input_texts=[], output_format=response["format"], delivery=response.get("delivery", "inline"))
+        self._write_clip(job_id, 0, params, response["audio"][0])
+
+    def close(self) -> None:
+        self._results.close()
+
+
+def read_manifest(path: str):
+    """Yield (job id, job input) per non-empty manifest line; the input is None if the line isn't a JSON object."""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError:
+                job = None
+            if not isinstance(job, dict):
+                yield f"line-{line_no}", None
+                continue
+            job_input = job.get("input", job)
+            job_id = job.get("id", job_input.get("id") if isinstance(job_input, dict) else None)
+            yield str(job_id if job_id is not None else f"line-{line_no}"), job_input
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Render a JSONL manifest of TTS jobs offline, resumably.")
+    parser.add_argument("manifest", help="JSONL file with one job per line")
+    parser.add_argument("--out-dir", required=True, help="Directory for the rendered clips")
+    parser.add_argument("--results", help="Results / checkpoint JSONL (default: <out-dir>/results.jsonl)")
+    parser.add_argument("--group-items", type=int, default=256, help="Texts per merged group (default: 256)")
+    args = parser.parse_args()
+
+    run = BulkRun(args.out_dir, args.results or os.path.join(args.out_dir, "results.jsonl"), args.group_items)
+    started = time.perf_counter()
+    try:
+        for job_id, job_input in read_manifest(args.manifest):
+            run.add_job(job_id, job_input)
+        run.flush()
+    finally:
+        run.close()
+
+    elapsed = time.perf_counter() - started
+    summary = {**run.counts, "audio_s": round(run.audio_s, 1), "elapsed_s": round(elapsed, 1)}
+    logger.info(f"Bulk run finished: {json.dumps(summary)}")
+    if run.counts["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
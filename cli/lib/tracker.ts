@@ -23,7 +23,8 @@ interface Batch<T> {
 
 /**
  * Build a deterministic key from the generation params + voice cloning config.
- * Items with the same key get batched together.
+ * Items with the same key get batched together. Seeds are per text on the
+ * server, so seeded items with different seeds can share a job.
  */
 function batchKey<T>(item: ItemRequest<T>, baseParams?: Partial<GenerationParams>): string {
 	const merged = { ...baseParams, ...item.params }
@@ -35,7 +36,7 @@ function batchKey<T>(item: ItemRequest<T>, baseParams?: Partial<GenerationParams
 		: "none"
 
 	const parts: string[] = [
-		`seed:${merged.seed ?? "none"}`,
+		`seeded:${merged.seed !== undefined}`,
 		`temp:${merged.temperature}`,
 		`top_p:${merged.top_p}`,
 		`top_k:${merged.top_k}`,
@@ -84,7 +85,10 @@ function buildBatches<T>(
 				top_p: mergedParams.top_p,
 				top_k: mergedParams.top_k,
 				output_format: mergedParams.output_format ?? "wav",
-				seed: mergedParams.seed,
+			}
+
+			if (mergedParams.seed !== undefined) {
+				jobInput.seeds = chunk.map((c) => ({ ...baseParams, ...c.request.params }).seed!)
 			}
 
 			// Voice cloning
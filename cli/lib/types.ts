@@ -12,6 +12,7 @@ export interface RunPodJobInput {
 	top_k?: number
 	output_format?: string
 	seed?: number
+	seeds?: number[]
 	voice?: string
 }
 
@@ -15,12 +15,23 @@ Voice cloning via preset voices or custom audio prompts:
 
 from __future__ import annotations
 
+import asyncio
 import base64
+import hashlib
 import io
 import json
+import itertools
+import math
+import multiprocessing
 import os
 import logging
 import sys
+import threading
+import time
+import unicodedata
+import warnings
+
+STARTUP_STARTED = time.perf_counter()
 
 # Configure logging
 logging.basicConfig(
@@ -39,17 +50,22 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
 
 import random
+import resource
 import re
-import tempfile
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
 
 import numpy as np
 import runpod
 import soundfile as sf
 import torch
-import torchaudio
 from transformers import AutoProcessor, DiaForConditionalGeneration
+from transformers.generation import LogitsProcessor
+from transformers.models.dia.processing_dia import DiaProcessorKwargs
 
 
 # ---------------------------------------------------------------------------
@@ -64,6 +80,108 @@ class AppError(Exception):
         super().__init__(message)
 
 
+# ---------------------------------------------------------------------------
+# Caching
+# ---------------------------------------------------------------------------
+
+class LRUCache:
+    """A small bounded mapping that evicts the least recently used entry."""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DiskCache:
+    """
+    Files under a directory, one per key, evicted oldest-first (by mtime)
+    once their total size exceeds max_bytes. Hits refresh the mtime.
+    I/O errors are logged and treated as misses; the cache never fails a job.
+    """
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size: int | None = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _files(self) -> list[tuple[float, int, str]]:
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Disk cache read failed for {path}: {e}")
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Disk cache write failed for {path}: {e}")
+            return
+
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._files())
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        # Evict down to 90% so we don't rescan the directory on every write
+        target = int(self.max_bytes * 0.9)
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+
 # ---------------------------------------------------------------------------
 # Initialisation — runs once at cold-start
 # ---------------------------------------------------------------------------
@@ -71,13 +189,100 @@ class AppError(Exception):
 MODEL_ID = os.environ.get("MODEL_ID", "pevers/parkiet")
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 VOICES_DIR = os.environ.get("VOICES_DIR", "/voices")
+VOICE_STORE_DIR = os.environ.get("VOICE_STORE_DIR", "") or os.path.join(VOICES_DIR, ".store")
+VOICE_CACHE_SIZE = int(os.environ.get("VOICE_CACHE_SIZE", "32"))
+HANDLER_MODE = os.environ.get("HANDLER_MODE", "default")  # "default" | "stream" | "batch" | "pool"
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", "8"))  # HANDLER_MODE=batch
+BATCH_WAIT_MS = float(os.environ.get("BATCH_WAIT_MS", "50"))  # HANDLER_MODE=batch
+DEFAULT_PRIORITY = os.environ.get("DEFAULT_PRIORITY", "normal")  # for jobs without "priority"
+MAX_QUEUED_TOKENS = int(os.environ.get("MAX_QUEUED_TOKENS", "0"))  # HANDLER_MODE=batch; 0 = admit everything
+POOL_WORKERS = int(os.environ.get("POOL_WORKERS", "2"))  # HANDLER_MODE=pool
+AUDIO_PROMPT_CACHE_SIZE = int(os.environ.get("AUDIO_PROMPT_CACHE_SIZE", "32"))
+DECODER_PROMPT_CACHE_SIZE = int(os.environ.get("DECODER_PROMPT_CACHE_SIZE", "64"))
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", "32"))
+TOKEN_BUDGET_HEADROOM = float(os.environ.get("TOKEN_BUDGET_HEADROOM", "1.5"))  # max_new_tokens="auto"
+TOKEN_BUDGET_MIN = int(os.environ.get("TOKEN_BUDGET_MIN", "86"))  # ~1s of audio
+TOKEN_LOG_PATH = os.environ.get("TOKEN_LOG_PATH", "")  # JSONL of generations to fit the predictor on
+MAX_BATCH_TOKENS = int(os.environ.get("MAX_BATCH_TOKENS", "65536"))
+MEMORY_BUDGET_MB = int(os.environ.get("MEMORY_BUDGET_MB", "0"))  # 0 = derive from free GPU memory
+GPU_MEMORY_FRACTION = float(os.environ.get("GPU_MEMORY_FRACTION", "0.9"))
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "")  # empty = no on-disk tier
+RESULT_CACHE_MAX_MB = int(os.environ.get("RESULT_CACHE_MAX_MB", "1024"))
+SEGMENT_STORE_DIR = os.environ.get("SEGMENT_STORE_DIR", "")  # empty = stories always render in full
+MODEL_DTYPE = os.environ.get("MODEL_DTYPE", "")  # empty = bfloat16 on GPU, float32 on CPU
+CPU_QUANTIZE = os.environ.get("CPU_QUANTIZE", "")  # "int8" = dynamic int8 Linear layers (CPU only)
+CPU_THREADS = int(os.environ.get("CPU_THREADS", "0"))  # 0 = torch's default, split across pool workers
+AUDIO_DELIVERY = os.environ.get("AUDIO_DELIVERY", "inline")  # "inline" | "url" | "key"
+S3_BUCKET = os.environ.get("S3_BUCKET", "")  # empty = always inline base64
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "")  # for MinIO, R2, etc.
+S3_PREFIX = os.environ.get("S3_PREFIX", "tts/")
+S3_URL_EXPIRY_S = int(os.environ.get("S3_URL_EXPIRY_S", "3600"))
+ENCODE_WORKERS = int(os.environ.get("ENCODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+WARMUP_TOKENS = int(os.environ.get("WARMUP_TOKENS", "32"))  # 0 = no warmup generation
+
+STARTUP_TIMINGS: dict[str, float] = {"imports": round(time.perf_counter() - STARTUP_STARTED, 3)}
+
+
+@contextmanager
+def startup_phase(name: str):
+    """Time one cold-start phase into STARTUP_TIMINGS."""
+    start = time.perf_counter()
+    yield
+    STARTUP_TIMINGS[name] = round(time.perf_counter() - start, 3)
+    logger.info(f"Startup phase '{name}' took {STARTUP_TIMINGS[name]:.2f}s")
+
+
+def _resolve_dtype(name: str) -> torch.dtype:
+    if not name:
+        return torch.bfloat16 if DEVICE == "cuda" else torch.float32
+    if name not in {"float32", "float16", "bfloat16"}:
+        raise ValueError(f"Invalid MODEL_DTYPE '{name}'. Allowed: bfloat16, float16, float32")
+    return getattr(torch, name)
+
+
+def cpu_threads() -> int:
+    """Intra-op threads per process: CPU_THREADS, or torch's default split across the pool's workers."""
+    if CPU_THREADS > 0:
+        return CPU_THREADS
+    processes = POOL_WORKERS if HANDLER_MODE == "pool" else 1
+    return max(1, torch.get_num_threads() // processes)
+
+
+def quantize_int8(model: torch.nn.Module) -> None:
+    """Swap the model's nn.Linear layers for dynamically quantized int8 ones, in place (CPU only)."""
+    if TORCH_DTYPE != torch.float32:
+        raise ValueError(f"CPU_QUANTIZE=int8 needs float32 weights, not MODEL_DTYPE={MODEL_DTYPE}")
+    with warnings.catch_warnings():
+        # torch.ao eager quantization is deprecated in favour of torchao, which we don't depend on
+        warnings.simplefilter("ignore")
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
 
 logger.info(f"Loading model '{MODEL_ID}' on device '{DEVICE}' ...")
 try:
-    processor = AutoProcessor.from_pretrained(MODEL_ID)
-    model = DiaForConditionalGeneration.from_pretrained(MODEL_ID).to(DEVICE)
+    TORCH_DTYPE = _resolve_dtype(MODEL_DTYPE)
+    if CPU_QUANTIZE not in {"", "int8"}:
+        raise ValueError(f"Invalid CPU_QUANTIZE '{CPU_QUANTIZE}'. Allowed: int8")
+    if DEVICE == "cpu":
+        torch.set_num_threads(cpu_threads())
+        logger.info(f"CPU inference with {torch.get_num_threads()} intra-op thread(s)")
+    with startup_phase("load_processor"):
+        processor = AutoProcessor.from_pretrained(MODEL_ID)
+        processor.audio_tokenizer.to(DEVICE)
+    with startup_phase("load_model"):
+        # Safetensors are memory-mapped and materialised on the GPU in the target dtype,
+        # without an fp32 copy in host memory first (device_map needs accelerate)
+        device_map = {"device_map": DEVICE} if DEVICE == "cuda" else {}
+        model = DiaForConditionalGeneration.from_pretrained(MODEL_ID, dtype=TORCH_DTYPE, **device_map)
+    if CPU_QUANTIZE and DEVICE == "cpu":
+        with startup_phase("quantize"):
+            quantize_int8(model)
+    elif CPU_QUANTIZE:
+        logger.warning(f"Ignoring CPU_QUANTIZE={CPU_QUANTIZE} on {DEVICE}")
     SAMPLE_RATE: int = processor.feature_extractor.sampling_rate
-    logger.info(f"Model loaded successfully. Sample rate: {SAMPLE_RATE}")
+    weights = f"{TORCH_DTYPE}, int8 Linear layers" if CPU_QUANTIZE and DEVICE == "cpu" else str(TORCH_DTYPE)
+    logger.info(f"Model loaded successfully ({weights}). Sample rate: {SAMPLE_RATE}")
 except Exception as e:
     logger.critical(f"Failed to load model: {e}")
     raise e
@@ -87,44 +292,115 @@ except Exception as e:
 # Audio helpers
 # ---------------------------------------------------------------------------
 
-def _load_waveform(waveform: torch.Tensor, sr: int) -> np.ndarray:
+OPUS_SAMPLE_RATE = 48000  # Opus only supports 8, 12, 16, 24 and 48 kHz
+_B64_ALPHABET = re.compile(r'[A-Za-z0-9+/]*={0,2}')
+_DECODE_BLOCK_FRAMES = 65536
+
+
+class Base64Reader(io.RawIOBase):
     """
-    Normalise a raw waveform tensor to mono at the model's sample rate.
-    Shared by both preset-voice loading and base64 decoding.
+    Seekable, read-only file over a base64 string. Every read decodes just
+    the 4-character groups it needs, so the decoded bytes never exist as one
+    buffer. The string must be unwrapped base64 (no whitespace).
     """
-    if waveform.shape[0] > 1:
-        waveform = waveform.mean(dim=0, keepdim=True)
-    if sr != SAMPLE_RATE:
-        waveform = torchaudio.transforms.Resample(orig_freq=sr, new_freq=SAMPLE_RATE)(waveform)
-    return waveform.squeeze(0).numpy()
+    def __init__(self, b64: str):
+        self._b64 = b64
+        padding = len(b64) - len(b64.rstrip("="))
+        self._size = len(b64) // 4 * 3 - padding
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(base + offset, 0)
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        end = self._size if size is None or size < 0 else min(self._pos + size, self._size)
+        if end <= self._pos:
+            return b""
+        first_group, last_group = self._pos // 3, (end + 2) // 3
+        data = base64.b64decode(self._b64[first_group * 4:last_group * 4])
+        data = data[self._pos - first_group * 3:end - first_group * 3]
+        self._pos = end
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+@lru_cache(maxsize=8)
+def _resampler(orig_sr: int, new_sr: int):
+    """Resample transforms are cached per rate pair; building one computes its filter kernel."""
+    import torchaudio  # only needed for prompts at another sample rate
+
+    return torchaudio.transforms.Resample(orig_freq=orig_sr, new_freq=new_sr)
+
+
+def _to_model_rate(audio: np.ndarray, sr: int) -> np.ndarray:
+    """Resample a mono float32 waveform to the model's sample rate."""
+    if sr == SAMPLE_RATE:
+        return audio
+    with torch.no_grad():
+        return _resampler(sr, SAMPLE_RATE)(torch.from_numpy(audio)).numpy()
+
+
+def read_audio(file) -> np.ndarray:
+    """
+    Read an audio file (path or file object) as a mono waveform at the model's
+    sample rate. Shared by both preset-voice loading and base64 decoding.
+    Multi-channel audio is mixed down block by block, so only the mono
+    result is held in memory.
+    """
+    with sf.SoundFile(file) as f:
+        audio = np.empty(f.frames, dtype=np.float32)
+        pos = 0
+        for block in f.blocks(blocksize=_DECODE_BLOCK_FRAMES, dtype="float32", always_2d=True):
+            audio[pos:pos + len(block)] = block[:, 0] if block.shape[1] == 1 else block.mean(axis=1)
+            pos += len(block)
+        return _to_model_rate(audio[:pos], f.samplerate)
 
 
 def load_audio_from_b64(b64_audio: str) -> np.ndarray:
     """Decode a base64 audio string to a numpy array at the model's sample rate."""
+    if not _B64_ALPHABET.fullmatch(b64_audio):
+        # Line-wrapped base64 is valid too, it just can't be read in place
+        b64_audio = "".join(b64_audio.split())
+        if not _B64_ALPHABET.fullmatch(b64_audio) or len(b64_audio) % 4:
+            raise AppError("AUDIO_DECODING_FAILED", "Invalid base64 string: unexpected characters or padding.")
+    elif len(b64_audio) % 4:
+        raise AppError("AUDIO_DECODING_FAILED", "Invalid base64 string: length is not a multiple of 4.")
+
+    reader = Base64Reader(b64_audio)
     try:
-        audio_bytes = base64.b64decode(b64_audio)
+        return read_audio(reader)
+    except sf.LibsndfileError:
+        pass  # not a format libsndfile knows; let torchaudio (ffmpeg) try
     except Exception as e:
-        raise AppError("AUDIO_DECODING_FAILED", f"Invalid base64 string: {e}")
+        raise AppError("AUDIO_DECODING_FAILED", f"Failed to decode audio file: {e}")
 
-    # Create temp file and write bytes, ensuring it is closed before loading
-    tmp_path = None
     try:
-        with tempfile.NamedTemporaryFile(suffix=".audio", delete=False) as f:
-            tmp_path = f.name
-            f.write(audio_bytes)
-            f.flush()
+        import torchaudio
 
-        waveform, sr = torchaudio.load(tmp_path)
-        return _load_waveform(waveform, sr)
+        reader.seek(0)
+        waveform, sr = torchaudio.load(reader)
+        return _to_model_rate(waveform.mean(dim=0).numpy(), sr)
     except Exception as e:
         raise AppError("AUDIO_DECODING_FAILED", f"Failed to decode audio file: {e}")
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
 
 
-def tensor_to_base64(audio_tensor: torch.Tensor, sample_rate: int, fmt: str = "wav") -> str:
-    """Convert a torch.Tensor audio waveform to a base64-encoded string."""
+def encode_audio(audio_tensor: torch.Tensor, sample_rate: int, fmt: str = "wav") -> bytes:
+    """Encode a torch.Tensor audio waveform as an audio file in the given format."""
     # Ensure shape is (samples,) or (samples, channels) as expected by soundfile.
     # Model/torchaudio often returns (channels, samples).
     if audio_tensor.ndim == 2:
@@ -139,11 +415,275 @@ def tensor_to_base64(audio_tensor: torch.Tensor, sample_rate: int, fmt: str = "w
     elif audio_tensor.ndim > 2:
         raise ValueError(f"Unsupported audio tensor shape: {audio_tensor.shape}")
 
-    audio_np = audio_tensor.cpu().float().numpy()
+    # No copies for the usual float32 CPU tensor
+    audio_np = audio_tensor.detach().cpu().float().numpy()
+
+    if fmt == "pcm":
+        # Raw 16-bit little-endian samples, no header
+        return (np.clip(audio_np, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+    subtype = None
+    if fmt == "opus":
+        with torch.no_grad():
+            audio_np = _resampler(sample_rate, OPUS_SAMPLE_RATE)(torch.from_numpy(audio_np.T)).numpy().T
+        sample_rate, fmt, subtype = OPUS_SAMPLE_RATE, "ogg", "OPUS"
+
     buf = io.BytesIO()
-    sf.write(buf, audio_np, sample_rate, format=fmt.upper())
-    buf.seek(0)
-    return base64.b64encode(buf.read()).decode("utf-8")
+    sf.write(buf, audio_np, sample_rate, format=fmt.upper(), subtype=subtype)
+    return buf.getvalue()
+
+
+def tensor_to_base64(audio_tensor: torch.Tensor, sample_rate: int, fmt: str = "wav") -> str:
+    """Convert a torch.Tensor audio waveform to a base64-encoded string."""
+    return base64.b64encode(encode_audio(audio_tensor, sample_rate, fmt=fmt)).decode("utf-8")
+
+
+def stitch_clips(clips: list[torch.Tensor], gaps_ms: list[float], sample_rate: int, crossfade_ms: float = 0.0) -> torch.Tensor:
+    """
+    Join mono clips into one waveform. `gaps_ms[i]` is the silence inserted
+    between clips[i] and clips[i + 1]. With `crossfade_ms`, clips without a
+    gap overlap with a linear crossfade; clips with a gap fade out and in.
+    """
+    fade_len = int(sample_rate * crossfade_ms / 1000)
+    pieces = [clips[0].float().flatten().clone()]
+
+    for clip, gap_ms in zip(clips[1:], gaps_ms):
+        prev = pieces[-1]
+        clip = clip.float().flatten().clone()
+        gap_len = int(sample_rate * gap_ms / 1000)
+
+        n = min(fade_len, len(prev), len(clip))
+        if n > 0:
+            ramp = torch.linspace(0.0, 1.0, n)
+            if gap_len > 0:
+                prev[-n:] *= 1.0 - ramp
+                clip[:n] *= ramp
+            else:
+                prev[-n:] = prev[-n:] * (1.0 - ramp) + clip[:n] * ramp
+                clip = clip[n:]
+
+        if gap_len > 0:
+            pieces.append(torch.zeros(gap_len))
+        pieces.append(clip)
+
+    return torch.cat(pieces)
+
+
+# ---------------------------------------------------------------------------
+# Post-processing — silence trimming and loudness, batched over clips
+# ---------------------------------------------------------------------------
+
+TRIM_FRAME_MS = 10.0
+TRIM_FLOOR_DB = 40.0  # frames this far below the clip's loudest frame are silence
+TRIM_PAD_MS = 50.0  # silence kept at either end of a trimmed clip
+PEAK_CEILING_DB = -1.0  # loudness gain never pushes a peak above this
+
+
+def pad_clips(clips: list[torch.Tensor]) -> tuple[torch.Tensor, torch.Tensor]:
+    """Zero-pad 1-D clips into one (clips, samples) tensor, plus their lengths."""
+    lengths = torch.tensor([len(c) for c in clips])
+    return torch.nn.utils.rnn.pad_sequence([c.float() for c in clips], batch_first=True), lengths
+
+
+def silence_bounds(batch: torch.Tensor, lengths: torch.Tensor, sample_rate: int) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Start and end sample of the non-silent part of each padded clip, keeping
+    TRIM_PAD_MS either side. Silence is relative to each clip's loudest
+    TRIM_FRAME_MS frame, so it adapts to the model's noise floor.
+    """
+    hop = int(sample_rate * TRIM_FRAME_MS / 1000)
+    num_frames = -(-batch.shape[1] // hop)
+    frames = torch.nn.functional.pad(batch, (0, num_frames * hop - batch.shape[1])).view(len(batch), num_frames, hop)
+    energy_db = 10 * torch.log10(frames.pow(2).mean(-1) + 1e-10)
+    in_clip = torch.arange(num_frames) * hop < lengths[:, None]
+    energy_db = energy_db.masked_fill(~in_clip, -math.inf)
+
+    active = energy_db > energy_db.amax(1, keepdim=True) - TRIM_FLOOR_DB
+    first = active.int().argmax(1)
+    last = num_frames - 1 - active.flip(1).int().argmax(1)
+    pad = int(sample_rate * TRIM_PAD_MS / 1000)
+    starts = (first * hop - pad).clamp(min=0)
+    ends = torch.minimum((last + 1) * hop + pad, lengths)
+    return starts, ends
+
+
+@lru_cache
+def _k_weighting(sample_rate: int) -> list[tuple[torch.Tensor, torch.Tensor]]:
+    """ITU-R BS.1770 K-weighting as two biquads (high shelf, then high pass): [(a, b), ...]."""
+    def biquad(kind: str, gain_db: float, q: float, fc: float):
+        a_gain = 10 ** (gain_db / 40)
+        w0 = 2 * math.pi * fc / sample_rate
+        alpha = math.sin(w0) / (2 * q)
+        cos_w0 = math.cos(w0)
+        if kind == "high_shelf":
+            sq = 2 * math.sqrt(a_gain) * alpha
+            b = [
+                a_gain * ((a_gain + 1) + (a_gain - 1) * cos_w0 + sq),
+                -2 * a_gain * ((a_gain - 1) + (a_gain + 1) * cos_w0),
+                a_gain * ((a_gain + 1) + (a_gain - 1) * cos_w0 - sq),
+            ]
+            a = [(a_gain + 1) - (a_gain - 1) * cos_w0 + sq, 2 * ((a_gain - 1) - (a_gain + 1) * cos_w0), (a_gain + 1) - (a_gain - 1) * cos_w0 - sq]
+        else:  # high pass
+            b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+            a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+        return torch.tensor(a), torch.tensor(b)
+
+    return [biquad("high_shelf", 4.0, 1 / math.sqrt(2), 1500.0), biquad("high_pass", 0.0, 0.5, 38.0)]
+
+
+def integrated_loudness(batch: torch.Tensor, lengths: torch.Tensor, sample_rate: int) -> torch.Tensor:
+    """
+    Gated integrated loudness (LUFS) of each padded clip, per BS.1770: mean
+    K-weighted power over 400 ms blocks (75% overlap) that pass the -70 LUFS
+    absolute gate and a relative gate 10 LU below the first pass. Clips under
+    400 ms count as a single block. NaN for clips with no block above the gate.
+    """
+    from torchaudio.functional import lfilter
+
+    weighted = batch
+    for a, b in _k_weighting(sample_rate):
+        weighted = lfilter(weighted, a, b, clamp=False)
+
+    step = sample_rate // 10
+    num_steps = weighted.shape[1] // step
+    # Clips shorter than one block are measured as one block over the whole clip
+    in_samples = torch.arange(weighted.shape[1]) < lengths[:, None]
+    clip_power = ((weighted.pow(2) * in_samples).sum(1) / lengths.clamp(min=1))[:, None]
+    short = lengths < 4 * step
+    if num_steps < 4:
+        power = clip_power
+        in_clip = torch.ones_like(power, dtype=torch.bool)
+    else:
+        power = weighted[:, :num_steps * step].reshape(len(batch), num_steps, step).pow(2).mean(-1)
+        power = power.unfold(1, 4, 1).mean(-1)
+        in_clip = (torch.arange(power.shape[1]) + 4) * step <= lengths[:, None]
+        # Per clip, so a short clip measures the same whatever it is batched with
+        power[short, 0] = clip_power[short, 0]
+        in_clip[short, 0] = True
+
+    def gated_mean(gate: torch.Tensor) -> torch.Tensor:
+        return (power * gate).sum(1) / gate.sum(1)
+
+    block_lufs = -0.691 + 10 * torch.log10(power + 1e-12)
+    gate = in_clip & (block_lufs > -70.0)
+    relative = -0.691 + 10 * torch.log10(gated_mean(gate)) - 10.0
+    gate &= block_lufs > relative[:, None]
+    return -0.691 + 10 * torch.log10(gated_mean(gate))
+
+
+def postprocess_clips(clips: list[torch.Tensor], sample_rate: int, trim: bool, target_lufs: float | None) -> list[torch.Tensor]:
+    """
+    Trim leading/trailing silence and/or normalise each clip to `target_lufs`
+    (peaks capped at PEAK_CEILING_DB), computed over all clips at once as one
+    zero-padded batch.
+    """
+    batch, lengths = pad_clips(clips)
+    if trim:
+        starts, ends = silence_bounds(batch, lengths, sample_rate)
+        clips = [batch[i, start:end] for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist()))]
+        if target_lufs is None:
+            return clips
+        batch, lengths = pad_clips(clips)
+
+    gain_db = target_lufs - integrated_loudness(batch, lengths, sample_rate)
+    peak_db = 20 * torch.log10(batch.abs().amax(1) + 1e-10)
+    gain_db = torch.minimum(gain_db, PEAK_CEILING_DB - peak_db).nan_to_num(0.0)
+    batch = batch * (10 ** (gain_db / 20))[:, None]
+    return [batch[i, :n] for i, n in enumerate(lengths.tolist())]
+
+
+# ---------------------------------------------------------------------------
+# Audio prompt encoding — DAC codes are computed once and reused
+# ---------------------------------------------------------------------------
+
+_AUDIO_KWARGS = DiaProcessorKwargs._defaults["audio_kwargs"]
+
+
+def encode_audio_prompt(audio: np.ndarray) -> torch.Tensor:
+    """
+    Encode a mono waveform into DAC codebook tokens of shape (frames, channels).
+    Mirrors the per-sample encoding done inside the processor, so the result
+    can be cached and reused across requests.
+    """
+    features = processor.feature_extractor(audio, sampling_rate=SAMPLE_RATE, return_tensors="pt")
+    hop_length = processor.feature_extractor.hop_length
+    audio_len = math.ceil(int(features["padding_mask"][0].sum()) / hop_length) * hop_length
+
+    codec = processor.audio_tokenizer
+    with torch.no_grad():
+        values = features["input_values"][0][None, ..., :audio_len].to(codec.device)
+        codes = codec.encode(values).audio_codes.transpose(1, 2)
+    return codes[0].cpu()
+
+
+def build_decoder_prompt(codes: torch.Tensor) -> dict[str, torch.Tensor]:
+    """
+    Build the delay-patterned decoder inputs (one row) for an audio prompt.
+    Equivalent to processor(audio=[audio]) without re-encoding; see
+    `DecoderPrompt.for_batch` for a whole batch.
+    """
+    delay_pattern = _AUDIO_KWARGS["delay_pattern"]
+    bos_token_id = _AUDIO_KWARGS["bos_token_id"]
+    pad_token_id = _AUDIO_KWARGS["pad_token_id"]
+    num_frames, num_channels = codes.shape
+    seq_len = 1 + num_frames + max(delay_pattern)  # bos + prompt + delay
+
+    prefill = torch.full((1, seq_len, num_channels), pad_token_id, dtype=torch.long)
+    prefill[0, 0] = bos_token_id
+    prefill[0, 1:num_frames + 1] = codes
+
+    precomputed_idx = processor.build_indices(
+        bsz=1,
+        seq_len=seq_len,
+        num_channels=num_channels,
+        delay_pattern=delay_pattern,
+        revert=False,
+    )
+    decoder_input_ids = processor.apply_audio_delay(
+        audio=prefill,
+        pad_token_id=pad_token_id,
+        bos_token_id=bos_token_id,
+        precomputed_idx=precomputed_idx,
+    )
+    return {
+        "decoder_input_ids": decoder_input_ids,
+        "decoder_attention_mask": torch.ones((1, seq_len), dtype=torch.long),
+    }
+
+
+@dataclass
+class DecoderPrompt:
+    """Delay-patterned decoder inputs for one audio prompt, kept on DEVICE."""
+    input_ids: torch.Tensor  # (1, seq_len, channels)
+    attention_mask: torch.Tensor  # (1, seq_len)
+    audio_prompt_len: int
+
+    def for_batch(self, batch_size: int) -> dict[str, torch.Tensor]:
+        # expand() broadcasts the single row without copying it per item
+        return {
+            "decoder_input_ids": self.input_ids.expand(batch_size, -1, -1),
+            "decoder_attention_mask": self.attention_mask.expand(batch_size, -1),
+        }
+
+
+# Custom audio prompts, keyed by a hash of their base64 payload
+AUDIO_PROMPT_CACHE = LRUCache(AUDIO_PROMPT_CACHE_SIZE)
+# Device-resident decoder prompts, keyed by audio prompt hash (presets and custom)
+DECODER_PROMPT_CACHE = LRUCache(DECODER_PROMPT_CACHE_SIZE)
+
+
+def decoder_prompt(codes: torch.Tensor, audio_prompt_hash: str) -> DecoderPrompt:
+    """The decoder prompt for a voice, built and moved to the device once per voice."""
+    prompt = DECODER_PROMPT_CACHE.get(audio_prompt_hash)
+    if prompt is None:
+        inputs = build_decoder_prompt(codes)
+        prompt = DecoderPrompt(
+            input_ids=inputs["decoder_input_ids"].to(DEVICE),
+            attention_mask=inputs["decoder_attention_mask"].to(DEVICE),
+            audio_prompt_len=processor.get_audio_prompt_len(inputs["decoder_attention_mask"]),
+        )
+        DECODER_PROMPT_CACHE.put(audio_prompt_hash, prompt)
+    return prompt
 
 
 # ---------------------------------------------------------------------------
@@ -178,117 +718,503 @@ def strip_consecutive_speaker_tags(text: str) -> str:
     return text
 
 
+_MD_LINK = re.compile(r'!?\[([^\]]*)\]\([^)]*\)')
+_MD_HEADING_OR_ITEM = re.compile(r'^\s*(?:#{1,6}\s+|[-*+]\s+|\d+[.)]\s+)')
+_MD_QUOTE = re.compile(r'^\s*>\s?')
+_MD_RULE = re.compile(r'^\s*(?:[-*_]\s*){3,}$')
+_MD_EMPHASIS = re.compile(r'(\*{1,3}|_{2,3}|`+)')
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+|(?<=[.!?…]["”’»])\s+')
+_CLAUSE_END = re.compile(r'(?<=[,;:])\s+')
+
+
+def markdown_to_paragraphs(text: str) -> list[str]:
+    """
+    Reduce markdown (or plain text) to a list of speakable paragraphs.
+    Headings and list items become paragraphs of their own; links, emphasis,
+    quote and code markers are stripped down to their text.
+    """
+    paragraphs: list[str] = []
+    current: list[str] = []
+
+    def flush():
+        if current:
+            paragraphs.append(" ".join(current))
+            current.clear()
+
+    for line in text.splitlines():
+        if not line.strip() or _MD_RULE.match(line):
+            flush()
+            continue
+
+        is_heading_or_item = bool(_MD_HEADING_OR_ITEM.match(line))
+        line = _MD_QUOTE.sub("", _MD_HEADING_OR_ITEM.sub("", line))
+        line = _MD_EMPHASIS.sub("", _MD_LINK.sub(r"\1", line)).strip()
+        if not line:
+            continue
+
+        if is_heading_or_item:
+            # Spoken as a sentence of its own, so it gets a pause either side
+            flush()
+            paragraphs.append(line if line[-1] in ".!?…:" else line + ".")
+        else:
+            current.append(line)
+    flush()
+    return paragraphs
+
+
+def _split_oversized(sentence: str, max_chars: int) -> list[str]:
+    """Split a sentence longer than max_chars at clause boundaries, then words."""
+    pieces: list[str] = []
+    for clause in _CLAUSE_END.split(sentence):
+        while len(clause) > max_chars:
+            cut = clause.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(clause[:cut].strip())
+            clause = clause[cut:].strip()
+        if clause:
+            pieces.append(clause)
+    return pieces
+
+
+def chunk_long_form(text: str, max_chars: int) -> list[tuple[str, bool]]:
+    """
+    Split markdown/plain text into chunks of at most max_chars, breaking at
+    sentence boundaries and never across paragraphs. Returns (chunk, starts
+    a new paragraph) pairs. Each chunk carries the speaker tag in effect, so
+    multi-speaker text keeps its speakers when it is split.
+    """
+    chunks: list[tuple[str, bool]] = []
+    speaker = "[S1]"
+
+    for paragraph in markdown_to_paragraphs(text):
+        sentences: list[str] = []
+        for sentence in _SENTENCE_END.split(paragraph):
+            sentences.extend(_split_oversized(sentence, max_chars) if len(sentence) > max_chars else [sentence])
+
+        current = ""
+        first = True
+        for sentence in sentences:
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                chunks.append((current, first))
+                first = False
+                current = ""
+            current = f"{current} {sentence}".strip()
+        if current:
+            chunks.append((current, first))
+
+    tagged: list[tuple[str, bool]] = []
+    for chunk, starts in chunks:
+        if not _SPEAKER_TAG.match(chunk):
+            chunk = f"{speaker} {chunk}"
+        speaker = _SPEAKER_TAG.findall(chunk)[-1]
+        tagged.append((chunk, starts))
+    return tagged
+
+
 # ---------------------------------------------------------------------------
-# Preset voices — loaded once at cold-start
+# Preset voices — compiled to a memory-mapped store, loaded on first use
 # ---------------------------------------------------------------------------
 
 @dataclass
 class PresetVoice:
-    """A pre-loaded voice for zero-latency voice cloning."""
+    """A compiled preset voice; `audio` is memory-mapped from the voice store."""
     name: str
     transcript: str
     audio: np.ndarray
+    codes: torch.Tensor | None = field(default=None, repr=False)
+    audio_hash: str = ""
 
     @property
     def duration_s(self) -> float:
         return len(self.audio) / SAMPLE_RATE
 
 
-def _load_preset_voices() -> dict[str, PresetVoice]:
-    """Load all voices from the voices manifest (if it exists)."""
-    manifest_path = os.path.join(VOICES_DIR, "voices.json")
-    voices: dict[str, PresetVoice] = {}
-
-    if not os.path.exists(manifest_path):
-        logger.warning(f"No voices manifest found at {manifest_path}, preset voices disabled.")
-        return voices
-
-    try:
-        with open(manifest_path, encoding="utf-8") as f:
-            manifest = json.load(f)
-    except (json.JSONDecodeError, ValueError, OSError) as e:
-        logger.error(f"Failed to load voices manifest from {manifest_path}: {e}")
-        manifest = {}
-
-    for voice_id, meta in manifest.items():
-        filename = meta.get("file")
-        if not isinstance(filename, str):
-            logger.warning(f"Voice '{voice_id}': missing or invalid 'file' entry in manifest, skipping.")
-            continue
-
-        wav_path = os.path.join(VOICES_DIR, filename)
-        if not os.path.exists(wav_path):
-            logger.warning(f"Voice '{voice_id}': file '{wav_path}' not found, skipping.")
-            continue
-
+class VoiceStore:
+    """
+    The voices listed in `voices.json`, compiled to `store_dir` as resampled
+    audio and codec tokens (`<audio hash>.audio.npy` / `.codes.npy`) plus an
+    `index.json` that records which manifest entry and WAV each came from.
+
+    Opening the store only reads the manifest and the index, so startup
+    costs the same however many voices there are. A voice is compiled the
+    first time it is used if it is new, or if its manifest entry or WAV
+    changed since it was compiled; the manifest is re-read whenever it
+    changes on disk. Loaded voices are kept in an LRU of `cache_size`, and
+    their audio is memory-mapped rather than read.
+    """
+    INDEX_VERSION = 1
+
+    def __init__(self, voices_dir: str, store_dir: str, cache_size: int):
+        self.voices_dir = voices_dir
+        self.store_dir = store_dir
+        self.manifest_path = os.path.join(voices_dir, "voices.json")
+        self.index_path = os.path.join(store_dir, "index.json")
+        self._cache = LRUCache(cache_size)
+        self._lock = threading.Lock()
+        self._manifest: dict[str, dict] = {}
+        self._manifest_mtime: int | None = -1
+        self._index = self._read_index()
+        self._refresh_manifest()
+
+    def ids(self) -> list[str]:
+        with self._lock:
+            self._refresh_manifest()
+            return list(self._manifest)
+
+    def get(self, voice_id: str) -> PresetVoice | None:
+        """The voice, compiling it first if needed; None if it's not in the manifest."""
+        with self._lock:
+            self._refresh_manifest()
+            meta = self._manifest.get(voice_id)
+            if meta is None:
+                return None
+
+            wav_path = os.path.join(self.voices_dir, meta["file"])
+            try:
+                stat = os.stat(wav_path)
+            except OSError:
+                raise AppError("VOICE_NOT_FOUND", f"Voice '{voice_id}': file '{meta['file']}' not found.")
+            source = {
+                "file": meta["file"],
+                "name": meta.get("name", voice_id),
+                "transcript": meta.get("transcript", ""),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }
+
+            cached = self._cache.get(voice_id)
+            if cached is not None and cached[0] == source:
+                return cached[1]
+
+            entry = self._index.get(voice_id)
+            voice = None
+            # Only a different WAV needs re-encoding; name and transcript live in the index
+            if entry is not None and all(entry["source"][k] == source[k] for k in ("file", "size", "mtime_ns")):
+                try:
+                    voice = self._load(entry["audio_hash"], source)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Voice '{voice_id}': compiled arrays unreadable, recompiling: {e}")
+                else:
+                    if entry["source"] != source:
+                        try:
+                            self._update_index(voice_id, {**entry, "source": source})
+                        except OSError as e:
+                            logger.warning(f"Could not update voice '{voice_id}' in {self.store_dir}: {e}")
+            if voice is None:
+                voice = self._compile(voice_id, wav_path, source)
+
+            self._cache.put(voice_id, (source, voice))
+            return voice
+
+    def compile_all(self) -> int:
+        """
+        Compile every voice that is new or changed and delete arrays no voice
+        uses any more. For image builds or volumes shared by many workers;
+        serving compiles on first use anyway. Returns the number of voices.
+        """
+        ids = self.ids()
+        for voice_id in ids:
+            try:
+                self.get(voice_id)
+            except AppError as e:
+                logger.error(f"Failed to compile voice '{voice_id}': {e.message}")
+        with self._lock:
+            used = {entry["audio_hash"] for entry in self._index.values()}
+            for name in os.listdir(self.store_dir) if os.path.isdir(self.store_dir) else []:
+                if name.endswith(".npy") and name.split(".", 1)[0] not in used:
+                    os.remove(os.path.join(self.store_dir, name))
+        return len(ids)
+
+    def _refresh_manifest(self) -> None:
+        """Re-read voices.json if it changed since the last read."""
         try:
-            waveform, sr = torchaudio.load(wav_path)
-            audio = _load_waveform(waveform, sr)
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._manifest_mtime:
+            return
+        self._manifest_mtime = mtime
+
+        if mtime is None:
+            logger.warning(f"No voices manifest found at {self.manifest_path}, preset voices disabled.")
+            self._manifest = {}
+            return
 
-            voice = PresetVoice(
-                name=meta.get("name", voice_id),
-                transcript=meta.get("transcript", ""),
-                audio=audio,
-            )
-            voices[voice_id] = voice
-            logger.info(f"Loaded voice '{voice_id}' ({voice.name}): {voice.duration_s:.1f}s, {len(audio)} samples")
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (json.JSONDecodeError, ValueError, OSError) as e:
+            logger.error(f"Failed to load voices manifest from {self.manifest_path}: {e}")
+            manifest = {}
+
+        self._manifest = {}
+        for voice_id, meta in manifest.items():
+            if not isinstance(meta, dict) or not isinstance(meta.get("file"), str):
+                logger.warning(f"Voice '{voice_id}': missing or invalid 'file' entry in manifest, skipping.")
+                continue
+            self._manifest[voice_id] = meta
+
+        compiled = sum(voice_id in self._index for voice_id in self._manifest)
+        logger.info(
+            f"Voices manifest lists {len(self._manifest)} preset voice(s), {compiled} compiled in {self.store_dir}"
+        )
+
+    def _read_index(self) -> dict[str, dict]:
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, ValueError, OSError) as e:
+            logger.warning(f"Ignoring unreadable voice store index {self.index_path}: {e}")
+            return {}
+        # Codec tokens are only valid for the model (and rate) they were encoded with
+        if (index.get("version"), index.get("model"), index.get("sample_rate")) != (
+            self.INDEX_VERSION, MODEL_ID, SAMPLE_RATE
+        ):
+            logger.info(f"Voice store {self.store_dir} was compiled for another model, recompiling voices on use")
+            return {}
+        return index.get("voices", {})
+
+    def _update_index(self, voice_id: str, entry: dict) -> None:
+        # Merge with the index on disk, in case another worker shares the store
+        index = {**self._read_index(), **self._index, voice_id: entry}
+        self._index = {key: value for key, value in index.items() if key in self._manifest}
+        payload = {"version": self.INDEX_VERSION, "model": MODEL_ID, "sample_rate": SAMPLE_RATE, "voices": self._index}
+        self._write_atomic("index.json", lambda f: f.write(json.dumps(payload, indent=1).encode("utf-8")))
+
+    def _write_atomic(self, name: str, write) -> None:
+        path = os.path.join(self.store_dir, name)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+
+    def _load(self, audio_hash: str, source: dict) -> PresetVoice:
+        audio = np.load(os.path.join(self.store_dir, f"{audio_hash}.audio.npy"), mmap_mode="r")
+        codes = np.load(os.path.join(self.store_dir, f"{audio_hash}.codes.npy"))
+        return PresetVoice(
+            name=source["name"],
+            transcript=source["transcript"],
+            audio=audio,
+            codes=torch.from_numpy(codes),
+            audio_hash=audio_hash,
+        )
+
+    def _compile(self, voice_id: str, wav_path: str, source: dict) -> PresetVoice:
+        try:
+            audio = read_audio(wav_path)
+            codes = encode_audio_prompt(audio)
         except Exception as e:
             logger.error(f"Failed to load voice '{voice_id}': {e}")
+            raise AppError("AUDIO_DECODING_FAILED", f"Failed to load voice '{voice_id}': {e}")
+
+        entry = {"source": source, "audio_hash": hashlib.sha256(audio.tobytes()).hexdigest()}
+        voice = PresetVoice(
+            name=source["name"],
+            transcript=source["transcript"],
+            audio=audio,
+            codes=codes,
+            audio_hash=entry["audio_hash"],
+        )
+        logger.info(
+            f"Compiled voice '{voice_id}' ({voice.name}): {voice.duration_s:.1f}s, "
+            f"{len(audio)} samples, {voice.codes.shape[0]} codec frames"
+        )
 
-    logger.info(f"Loaded {len(voices)} preset voice(s): {list(voices.keys())}")
-    return voices
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            self._write_atomic(f"{entry['audio_hash']}.audio.npy", lambda f: np.save(f, audio))
+            self._write_atomic(f"{entry['audio_hash']}.codes.npy", lambda f: np.save(f, codes.numpy()))
+            self._update_index(voice_id, entry)
+        except OSError as e:
+            # A read-only store still serves the voice, it's just compiled again next cold start
+            logger.warning(f"Could not save voice '{voice_id}' to {self.store_dir}: {e}")
+            return voice
+        # Swap the in-memory arrays for the memory-mapped copy
+        return self._load(entry["audio_hash"], source)
 
 
-PRESET_VOICES = _load_preset_voices()
+with startup_phase("preset_voices"):
+    VOICE_STORE = VoiceStore(VOICES_DIR, VOICE_STORE_DIR, VOICE_CACHE_SIZE)
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+@dataclass
+class JobMetrics:
+    """Wall time per pipeline stage, plus generated tokens and audio per item."""
+    stages: dict[str, float] = field(default_factory=dict)
+    item_tokens: dict[int, int] = field(default_factory=dict)
+    item_audio_s: dict[int, float] = field(default_factory=dict)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        """Add the block's wall time to `name` (stages can run once per sub-batch)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def summary(self, total_s: float) -> dict:
+        tokens = sum(self.item_tokens.values())
+        audio_s = sum(self.item_audio_s.values())
+        generate_s = self.stages.get("generate", 0.0)
+        summary = {
+            "total_s": round(total_s, 3),
+            "stages_s": {name: round(t, 3) for name, t in self.stages.items()},
+            "generated_tokens": tokens,
+            "tokens_per_s": round(tokens / generate_s, 1) if generate_s else None,
+            "audio_s": round(audio_s, 2),
+            "rtf": round(audio_s / total_s, 3) if total_s else None,
+            # ru_maxrss is in KiB on Linux; it is the process peak, not per job
+            "peak_host_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+        if torch.cuda.is_available():
+            summary["peak_device_mb"] = round(torch.cuda.max_memory_allocated() / 2**20, 1)
+        return summary
+
+
+def reset_peak_memory() -> None:
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
 
 
 # ---------------------------------------------------------------------------
 # Input parsing
 # ---------------------------------------------------------------------------
 
+@dataclass
+class LongFormPlan:
+    """A long text split into chunks, and how to join their audio back together."""
+    chunks: list[str]
+    paragraph_starts: list[bool]
+    silence_ms: float = 250.0
+    paragraph_silence_ms: float = 700.0
+    crossfade_ms: float = 0.0
+    story_id: str | None = None  # reuse unchanged chunks from the story's last render
+
+    def gaps_ms(self) -> list[float]:
+        """Silence to insert before each chunk after the first."""
+        return [
+            self.paragraph_silence_ms if starts else self.silence_ms
+            for starts in self.paragraph_starts[1:]
+        ]
+
+
+_STORY_ID = re.compile(r'[A-Za-z0-9._-]{1,128}')
+
+PRIORITY_CLASSES = ("interactive", "normal", "bulk")  # most urgent first
+
+
+def parse_long_form(job_input: dict, max_new_tokens: int) -> LongFormPlan:
+    """Split the long-form 'text' input into chunks that fit the token budget."""
+    text = job_input.get("text")
+    if not isinstance(text, str) or not text.strip():
+        raise AppError("INVALID_INPUT", "long_form requires a non-empty 'text' string (markdown or plain text).")
+
+    # Leave headroom: chunks that run right up to max_new_tokens get cut off
+    default_chunk_chars = max(20, int(max_new_tokens / AUDIO_FRAMES_PER_CHAR * 0.75))
+    try:
+        max_chunk_chars = int(job_input.get("max_chunk_chars", default_chunk_chars))
+        silence_ms = float(job_input.get("silence_ms", 250.0))
+        paragraph_silence_ms = float(job_input.get("paragraph_silence_ms", 700.0))
+        crossfade_ms = float(job_input.get("crossfade_ms", 0.0))
+    except (ValueError, TypeError) as e:
+        raise AppError("INVALID_INPUT", f"Invalid long_form parameter: {e}. Check max_chunk_chars, silence_ms, paragraph_silence_ms, crossfade_ms.")
+
+    if max_chunk_chars < 20:
+        raise AppError("INVALID_INPUT", f"max_chunk_chars must be at least 20 (got {max_chunk_chars}).")
+    if min(silence_ms, paragraph_silence_ms, crossfade_ms) < 0:
+        raise AppError("INVALID_INPUT", "silence_ms, paragraph_silence_ms and crossfade_ms must not be negative.")
+
+    story_id = job_input.get("story_id")
+    if story_id is not None and not (isinstance(story_id, str) and _STORY_ID.fullmatch(story_id)):
+        raise AppError("INVALID_INPUT", "story_id must be 1-128 letters, digits, '.', '_' or '-'.")
+
+    chunks = chunk_long_form(text, max_chunk_chars)
+    if not chunks:
+        raise AppError("INVALID_INPUT", "long_form 'text' contains no speakable text.")
+
+    return LongFormPlan(
+        chunks=[c for c, _ in chunks],
+        paragraph_starts=[starts for _, starts in chunks],
+        silence_ms=silence_ms,
+        paragraph_silence_ms=paragraph_silence_ms,
+        crossfade_ms=crossfade_ms,
+        story_id=story_id,
+    )
+
+
 @dataclass
 class JobParams:
     """Parsed and validated job parameters."""
     input_texts: list[str]
     max_new_tokens: int = 3072
+    token_budgets: list[int] | None = None  # per item, for max_new_tokens="auto"
     guidance_scale: float = 3.0
     temperature: float = 1.8
     top_p: float = 0.90
     top_k: int = 50
     seed: int | None = None
+    seeds: list[int] | None = None  # one per input text; [seed] * N for a job-level seed
     output_format: str = "wav"
+    delivery: str = "inline"
+    trim_silence: bool = False
+    target_lufs: float | None = None
+    priority: str = "normal"
+    stream: bool = False
+    return_metrics: bool = False
+    long_form: LongFormPlan | None = None
     # Voice cloning
     voice: str | None = None
     audio_prompt_b64: str | None = None
     audio_prompt_transcript: str = ""
+    text_features: list[tuple[int, int, int]] = field(default_factory=list, repr=False)
     # Resolved at prepare-time
     audio_array: np.ndarray | None = field(default=None, repr=False)
+    audio_codes: torch.Tensor | None = field(default=None, repr=False)
+    audio_prompt_hash: str | None = None
+    # Filled in during generation
+    item_errors: dict[int, AppError] = field(default_factory=dict, repr=False)
+    cached_items: set[int] = field(default_factory=set, repr=False)
+    metrics: JobMetrics = field(default_factory=JobMetrics, repr=False)
 
     @property
     def is_voice_cloning(self) -> bool:
         return self.voice is not None or self.audio_prompt_b64 is not None
 
 
+def parse_seeds(job_input: dict, seed: int | None) -> list[int] | None:
+    """Validate the optional per-item 'seeds' list."""
+    seeds = job_input.get("seeds")
+    if seeds is None:
+        return None
+    if seed is not None:
+        raise AppError("INVALID_INPUT", "Use either 'seed' or 'seeds', not both.")
+    if not isinstance(seeds, list) or not seeds:
+        raise AppError("INVALID_INPUT", "'seeds' must be a non-empty list of integers.")
+    try:
+        return [int(s) for s in seeds]
+    except (ValueError, TypeError):
+        raise AppError("INVALID_INPUT", f"Invalid 'seeds' {seeds}: all seeds must be integers.")
+
+
 def parse_input(job_input: dict) -> JobParams:
     """
     Parse raw job input into a JobParams dataclass.
     Raises AppError if validation fails.
     """
-    texts = job_input.get("texts")
-
-    if not texts or not isinstance(texts, list):
-        raise AppError("INVALID_INPUT", "Missing required field 'texts' (list of strings).")
-
-    if any(not isinstance(t, str) for t in texts):
-        raise AppError("INVALID_INPUT", "All items in 'texts' must be strings.")
-
-
-    # Ensure every text starts with a speaker tag
-    input_texts = [ensure_speaker_tag(t) for t in texts]
-
     # Validate numeric inputs
+    auto_tokens = job_input.get("max_new_tokens") == "auto"
     try:
-        max_new_tokens = int(job_input.get("max_new_tokens", 3072))
+        max_new_tokens = 3072 if auto_tokens else int(job_input.get("max_new_tokens", 3072))
         guidance_scale = float(job_input.get("guidance_scale", 3.0))
         temperature = float(job_input.get("temperature", 1.8))
         top_p = float(job_input.get("top_p", 0.90))
@@ -296,6 +1222,22 @@ def parse_input(job_input: dict) -> JobParams:
     except (ValueError, TypeError) as e:
         raise AppError("INVALID_INPUT", f"Invalid numeric parameter: {e}. Check max_new_tokens, guidance_scale, temperature, top_p, top_k.")
 
+    long_form = None
+    if job_input.get("long_form"):
+        long_form = parse_long_form(job_input, max_new_tokens)
+        texts = long_form.chunks
+    else:
+        texts = job_input.get("texts")
+
+        if not texts or not isinstance(texts, list):
+            raise AppError("INVALID_INPUT", "Missing required field 'texts' (list of strings).")
+
+        if any(not isinstance(t, str) for t in texts):
+            raise AppError("INVALID_INPUT", "All items in 'texts' must be strings.")
+
+    # Ensure every text starts with a speaker tag
+    input_texts = [ensure_speaker_tag(t) for t in texts]
+
     seed = job_input.get("seed")
     if seed is not None:
         try:
@@ -303,20 +1245,72 @@ def parse_input(job_input: dict) -> JobParams:
         except (ValueError, TypeError):
             raise AppError("INVALID_INPUT", f"Invalid seed value '{seed}': must be an integer.")
 
+    seeds = parse_seeds(job_input, seed)
+    if seeds is not None:
+        if long_form:
+            raise AppError("INVALID_INPUT", "'seeds' is not supported with long_form; use 'seed'.")
+        if len(input_texts) == 1 and len(seeds) > 1:
+            # Takes: the same text once per seed, all in one batch
+            input_texts = input_texts * len(seeds)
+        elif len(seeds) != len(input_texts):
+            raise AppError(
+                "INVALID_INPUT",
+                f"'seeds' must have one seed per text ({len(input_texts)}), or several seeds for a single text (got {len(seeds)}).",
+            )
+    elif seed is not None:
+        seeds = [seed] * len(input_texts)
+
+    # Before the voice transcript gets prepended: only the new speech counts
+    features = [text_features(t) for t in input_texts]
+    token_budgets = None
+    if auto_tokens:
+        token_budgets = [TOKEN_BUDGET_MODEL.budget(f, max_new_tokens) for f in features]
+        max_new_tokens = max(token_budgets)
+
     output_format = job_input.get("output_format", "wav").lower()
-    allowed_formats = {"wav", "mp3", "flac"}
+    allowed_formats = {"wav", "mp3", "flac", "opus", "pcm"}
     if output_format not in allowed_formats:
         raise AppError("INVALID_INPUT", f"Invalid output_format '{output_format}'. Allowed: {sorted(list(allowed_formats))}")
 
+    target_lufs = job_input.get("target_lufs")
+    if target_lufs is not None:
+        try:
+            target_lufs = float(target_lufs)
+        except (ValueError, TypeError):
+            raise AppError("INVALID_INPUT", f"Invalid target_lufs '{target_lufs}': must be a number.")
+        if not -70.0 <= target_lufs <= 0.0:
+            raise AppError("INVALID_INPUT", f"target_lufs must be between -70 and 0 (got {target_lufs}).")
+
+    priority = job_input.get("priority", DEFAULT_PRIORITY)
+    if priority not in PRIORITY_CLASSES:
+        raise AppError("INVALID_INPUT", f"Invalid priority '{priority}'. Allowed: {list(PRIORITY_CLASSES)}")
+
+    delivery = job_input.get("delivery", AUDIO_DELIVERY)
+    if delivery not in {"inline", "url", "key"}:
+        raise AppError("INVALID_INPUT", f"Invalid delivery '{delivery}'. Allowed: ['inline', 'key', 'url']")
+    if delivery != "inline" and not S3_BUCKET:
+        logger.warning(f"delivery '{delivery}' requested but S3_BUCKET is not set, returning inline base64.")
+        delivery = "inline"
+
     return JobParams(
         input_texts=input_texts,
         max_new_tokens=max_new_tokens,
+        token_budgets=token_budgets,
+        text_features=features,
         guidance_scale=guidance_scale,
         temperature=temperature,
         top_p=top_p,
         top_k=top_k,
         seed=seed,
+        seeds=seeds,
         output_format=output_format,
+        delivery=delivery,
+        trim_silence=bool(job_input.get("trim_silence", False)),
+        target_lufs=target_lufs,
+        priority=priority,
+        stream=HANDLER_MODE == "stream" and bool(job_input.get("stream", False)),  # ignored by other modes
+        return_metrics=bool(job_input.get("metrics", False)),
+        long_form=long_form,
         voice=job_input.get("voice"),
         audio_prompt_b64=job_input.get("audio_prompt"),
         audio_prompt_transcript=job_input.get("audio_prompt_transcript", ""),
@@ -329,48 +1323,61 @@ def parse_input(job_input: dict) -> JobParams:
 
 def resolve_voice_cloning(params: JobParams) -> None:
     """
-    Resolve the voice cloning audio + transcript onto params.
+    Resolve the voice cloning audio codes + transcript onto params.
     Mutates params in-place. Raises AppError if something's wrong.
     """
     # ── Preset voice ────────────────────────────────────────────
     if params.voice:
         voice_key = params.voice.upper()
-        if voice_key not in PRESET_VOICES:
-            available = list(PRESET_VOICES.keys()) or ["none loaded"]
+        preset = VOICE_STORE.get(voice_key)
+        if preset is None:
+            available = VOICE_STORE.ids() or ["none loaded"]
             raise AppError("VOICE_NOT_FOUND", f"Unknown voice '{params.voice}'. Available: {available}")
 
-        preset = PRESET_VOICES[voice_key]
         logger.info(f"Using preset voice: {voice_key} ({preset.name})")
         params.audio_array = preset.audio
+        params.audio_codes = preset.codes
+        params.audio_prompt_hash = preset.audio_hash
 
         if not params.audio_prompt_transcript:
             params.audio_prompt_transcript = preset.transcript
 
     # ── Custom audio prompt ─────────────────────────────────────
     elif params.audio_prompt_b64:
-        params.audio_array = load_audio_from_b64(params.audio_prompt_b64)
+        params.audio_prompt_hash = hashlib.sha256(params.audio_prompt_b64.encode("utf-8")).hexdigest()
+        params.audio_codes = AUDIO_PROMPT_CACHE.get(params.audio_prompt_hash)
+        if params.audio_codes is not None:
+            logger.info(f"Using cached audio prompt codes ({params.audio_prompt_hash[:12]})")
+        else:
+            params.audio_array = load_audio_from_b64(params.audio_prompt_b64)
 
     # ── No voice cloning ────────────────────────────────────────
     else:
         return
 
-    # ── Validate the resolved audio ─────────────────────────────
-    audio = params.audio_array
-    duration_s = len(audio) / SAMPLE_RATE
+    # ── Validate the resolved audio (cached prompts were validated on insert) ──
+    if params.audio_array is not None:
+        audio = params.audio_array
+        duration_s = len(audio) / SAMPLE_RATE
 
-    logger.debug(f"Voice cloning mode: {len(audio)} samples, {duration_s:.2f}s @ {SAMPLE_RATE} Hz")
+        logger.debug(f"Voice cloning mode: {len(audio)} samples, {duration_s:.2f}s @ {SAMPLE_RATE} Hz")
 
-    if len(audio) == 0:
-        raise AppError("AUDIO_QUALITY_ISSUE", "Audio prompt decoded to zero samples. Check the audio file.")
+        if len(audio) == 0:
+            raise AppError("AUDIO_QUALITY_ISSUE", "Audio prompt decoded to zero samples. Check the audio file.")
 
-    if np.abs(audio).max() < 1e-6:
-        raise AppError("AUDIO_QUALITY_ISSUE", "Audio prompt appears to be silent (all zeros). Check the audio file.")
+        if np.abs(audio).max() < 1e-6:
+            raise AppError("AUDIO_QUALITY_ISSUE", "Audio prompt appears to be silent (all zeros). Check the audio file.")
 
-    if duration_s < 3:
-        logger.warning(f"Audio prompt is very short ({duration_s:.2f}s). Voice cloning may not work well with prompts under 3 seconds.")
+        if duration_s < 3:
+            logger.warning(f"Audio prompt is very short ({duration_s:.2f}s). Voice cloning may not work well with prompts under 3 seconds.")
 
-    if duration_s > 15:
-        logger.warning(f"Audio prompt is very long ({duration_s:.2f}s). This may cause memory issues. Consider using a 5-15 second clip.")
+        if duration_s > 15:
+            logger.warning(f"Audio prompt is very long ({duration_s:.2f}s). This may cause memory issues. Consider using a 5-15 second clip.")
+
+    # ── Encode a new custom prompt once and cache its codes ─────
+    if params.audio_codes is None:
+        params.audio_codes = encode_audio_prompt(params.audio_array)
+        AUDIO_PROMPT_CACHE.put(params.audio_prompt_hash, params.audio_codes)
 
     if not params.audio_prompt_transcript:
         logger.warning("No transcript provided. Voice cloning works best when the transcript matches the audio prompt.")
@@ -385,6 +1392,413 @@ def resolve_voice_cloning(params: JobParams) -> None:
     return None
 
 
+# ---------------------------------------------------------------------------
+# Batch scheduling — length-bucketed sub-batches
+# ---------------------------------------------------------------------------
+
+# Dia emits ~86 codec frames per second; Dutch speech runs at ~14 characters
+# per second, so each character costs roughly six decoder steps.
+AUDIO_FRAMES_PER_CHAR = 6.0
+
+# Cumulative padding waste since cold start (decoder steps spent on finished items)
+PADDING_WASTE_TOKENS = {"bucketed": 0, "single_batch": 0}
+
+
+def estimate_audio_tokens(text: str) -> int:
+    """
+    Rough estimate of the decoder length for a text, used for bucketing only.
+    When voice cloning, the prepended transcript accounts for the audio prompt.
+    """
+    spoken = _SPEAKER_TAG.sub("", text).strip()
+    return max(1, math.ceil(len(spoken) * AUDIO_FRAMES_PER_CHAR))
+
+
+def plan_batches(texts: list[str], max_items: int, max_tokens: int) -> list[list[int]]:
+    """
+    Group text indices into sub-batches of similar estimated length.
+
+    Texts are sorted by estimated decoder length and packed greedily so that
+    each sub-batch stays under `max_items` items and `max_tokens` padded
+    decoder tokens (items × longest estimate). Returns lists of original indices.
+    """
+    lengths = [estimate_audio_tokens(t) for t in texts]
+    order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+    batches: list[list[int]] = []
+    current: list[int] = []
+    for i in order:
+        # Ascending order, so the newcomer sets the padded length of the bucket
+        if current and (len(current) + 1 > max_items or (len(current) + 1) * lengths[i] > max_tokens):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def generated_lengths(outputs: torch.Tensor) -> list[int]:
+    """
+    Number of decoder steps each item actually needed: up to its EOS plus the
+    delay-pattern flush that follows it. Anything beyond that is padding.
+    """
+    pad_token_id = _AUDIO_KWARGS["pad_token_id"]
+    max_delay = max(_AUDIO_KWARGS["delay_pattern"])
+    padding = (outputs[:, :, 0] == pad_token_id).sum(dim=-1)
+    return (outputs.shape[1] - padding + max_delay).clamp(max=outputs.shape[1]).tolist()
+
+
+# ---------------------------------------------------------------------------
+# Memory planning — keep each sub-batch within the device memory budget
+# ---------------------------------------------------------------------------
+
+def estimate_peak_memory(
+    batch_size: int,
+    text_len: int,
+    prompt_len: int,
+    max_new_tokens: int,
+    guidance_scale: float,
+) -> int:
+    """
+    Rough estimate (bytes) of the device memory one `model.generate` call needs
+    on top of the weights: self- and cross-attention KV caches for the whole
+    decode, plus the transient activations of the widest forward pass.
+    """
+    enc = model.config.encoder_config
+    dec = model.config.decoder_config
+    dtype_bytes = model.dtype.itemsize
+
+    # Classifier-free guidance runs a conditional and an unconditional copy
+    rows = batch_size * (2 if guidance_scale != 1 else 1)
+    seq_len = prompt_len + max_new_tokens + max(_AUDIO_KWARGS["delay_pattern"])
+
+    self_kv = 2 * dec.num_hidden_layers * dec.num_key_value_heads * dec.head_dim * seq_len
+    cross_kv = 2 * dec.num_hidden_layers * dec.cross_num_key_value_heads * dec.cross_head_dim * text_len
+    # MLP gate/up/activation buffers dominate the encoder pass and the decoder prefill
+    activations = 3 * max(text_len * enc.intermediate_size, prompt_len * dec.intermediate_size)
+    logits = dec.num_channels * dec.vocab_size * 4  # float32 scores for the last step
+
+    return rows * ((self_kv + cross_kv + activations) * dtype_bytes + logits)
+
+
+def available_memory() -> int | None:
+    """Bytes a generate call may use, or None when there is no budget to enforce."""
+    if MEMORY_BUDGET_MB > 0:
+        return MEMORY_BUDGET_MB * 2**20
+    if DEVICE != "cuda":
+        return None
+
+    free, _ = torch.cuda.mem_get_info()
+    reusable = torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+    return int((free + reusable) * GPU_MEMORY_FRACTION)
+
+
+def fit_batches_to_memory(params: JobParams, batches: list[list[int]], prompt_len: int) -> list[list[int]]:
+    """Split sub-batches whose estimated peak memory exceeds the budget."""
+    budget = available_memory()
+    if budget is None:
+        return batches
+
+    fitted: list[list[int]] = []
+    for batch in batches:
+        text_len = max(len(params.input_texts[i].encode("utf-8")) for i in batch)
+        per_item = estimate_peak_memory(1, text_len, prompt_len, params.max_new_tokens, params.guidance_scale)
+        max_items = max(1, budget // per_item)
+        if len(batch) > max_items:
+            logger.info(
+                f"Memory planner: {len(batch)} items need ~{len(batch) * per_item / 2**20:.0f} MB "
+                f"(budget {budget / 2**20:.0f} MB), splitting into chunks of {max_items}"
+            )
+        fitted.extend(batch[i:i + max_items] for i in range(0, len(batch), max_items))
+    return fitted
+
+
+# ---------------------------------------------------------------------------
+# Token budgets — per-item max_new_tokens predicted from the text ("auto")
+# ---------------------------------------------------------------------------
+
+_PAUSE = re.compile(r'[.,!?;:…]')
+
+
+def text_features(text: str) -> tuple[int, int, int]:
+    """(letters, pauses, speaker turns) of a text, the predictor's inputs."""
+    spoken = _SPEAKER_TAG.sub(" ", text)
+    letters = sum(c.isalnum() for c in spoken)
+    return letters, len(_PAUSE.findall(spoken)), max(1, len(_SPEAKER_TAG.findall(text)))
+
+
+@dataclass
+class TokenBudgetModel:
+    """Linear model of the decoder steps a text needs, in audio frames (~86 per second)."""
+    intercept: float = 20.0
+    per_letter: float = 6.0
+    per_pause: float = 20.0
+    per_turn: float = 25.0
+
+    def predict(self, features: tuple[int, int, int]) -> float:
+        letters, pauses, turns = features
+        return self.intercept + self.per_letter * letters + self.per_pause * pauses + self.per_turn * turns
+
+    def budget(self, features: tuple[int, int, int], limit: int) -> int:
+        return min(limit, max(TOKEN_BUDGET_MIN, math.ceil(self.predict(features) * TOKEN_BUDGET_HEADROOM)))
+
+
+def fit_token_budget_model(path: str, min_records: int = 50) -> TokenBudgetModel:
+    """
+    Least-squares fit of a TokenBudgetModel to logged generations (see
+    `log_generations`). Only items that ended on EOS are used; truncated ones
+    would bias the fit low. Falls back to the defaults without enough data.
+    """
+    rows = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("eos"):
+                    rows.append((record["letters"], record["pauses"], record["turns"], record["tokens"]))
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Could not read token log {path}: {e}")
+
+    if len(rows) < min_records:
+        logger.info(f"Token budget: {len(rows)} logged generation(s), using the default model")
+        return TokenBudgetModel()
+
+    data = np.asarray(rows, dtype=np.float64)
+    features = np.column_stack([np.ones(len(data)), data[:, :3]])
+    coef, *_ = np.linalg.lstsq(features, data[:, 3], rcond=None)
+    model = TokenBudgetModel(*(float(c) for c in np.maximum(coef, 0.0)))
+    logger.info(f"Token budget: fitted on {len(rows)} generation(s): {model}")
+    return model
+
+
+def log_generations(params: JobParams, batch: list[int], tokens: list[int], eos: list[bool]) -> None:
+    """Append one record per generated item to TOKEN_LOG_PATH, the predictor's training data."""
+    if not TOKEN_LOG_PATH:
+        return
+    try:
+        with open(TOKEN_LOG_PATH, "a", encoding="utf-8") as f:
+            for i, n, ended in zip(batch, tokens, eos):
+                letters, pauses, turns = params.text_features[i]
+                f.write(json.dumps({"letters": letters, "pauses": pauses, "turns": turns, "tokens": n, "eos": ended}) + "\n")
+    except OSError as e:
+        logger.warning(f"Could not write token log {TOKEN_LOG_PATH}: {e}")
+
+
+class TokenBudgetLogitsProcessor(LogitsProcessor):
+    """
+    Forces EOS on the first codebook channel for items that have used up
+    their token budget. Runs just before Dia's EOS/delay processor, which
+    then ends the item the usual way (flushing the delayed channels).
+    """
+    def __init__(self, budgets: list[int], num_channels: int, eos_token_id: int):
+        self.budgets = torch.tensor(budgets)
+        self.num_channels = num_channels
+        self.eos_token_id = eos_token_id
+        self.start_len: int | None = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.start_len is None:
+            self.start_len = input_ids.shape[1]
+            self.budgets = self.budgets.to(scores.device)
+        over = (input_ids.shape[1] - self.start_len) >= self.budgets
+        if over.any():
+            scores = scores.reshape(-1, self.num_channels, scores.shape[-1])
+            scores[over, 0, :] = -float("inf")
+            scores[over, 0, self.eos_token_id] = 0.0
+            scores = scores.reshape(-1, scores.shape[-1])
+        return scores
+
+
+TOKEN_BUDGET_MODEL = fit_token_budget_model(TOKEN_LOG_PATH) if TOKEN_LOG_PATH else TokenBudgetModel()
+
+
+# ---------------------------------------------------------------------------
+# Result cache — deterministic (seeded) outputs keyed by content
+# ---------------------------------------------------------------------------
+
+RESULT_CACHE = LRUCache(RESULT_CACHE_SIZE)
+RESULT_DISK_CACHE = DiskCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_MB * 2**20) if RESULT_CACHE_DIR else None
+
+
+def result_cache_enabled(params: JobParams) -> bool:
+    """Outputs are only cacheable when they are deterministic, i.e. seeded."""
+    return params.seeds is not None and (RESULT_CACHE.maxsize > 0 or RESULT_DISK_CACHE is not None)
+
+
+def result_cache_key(params: JobParams, i: int) -> str:
+    """Content address of text i's encoded audio."""
+    payload = {
+        "model": MODEL_ID,
+        "text": params.input_texts[i],
+        "audio_prompt": params.audio_prompt_hash,
+        "max_new_tokens": params.token_budgets[i] if params.token_budgets is not None else params.max_new_tokens,
+        "guidance_scale": params.guidance_scale,
+        "temperature": params.temperature,
+        "top_p": params.top_p,
+        "top_k": params.top_k,
+        "seed": params.seeds[i],
+        "sampler": PerItemSamplingLogitsProcessor.VERSION,
+        "output_format": params.output_format,
+        "trim_silence": params.trim_silence,
+        "target_lufs": params.target_lufs,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def result_cache_get(key: str) -> bytes | None:
+    data = RESULT_CACHE.get(key)
+    if data is None and RESULT_DISK_CACHE is not None:
+        data = RESULT_DISK_CACHE.get(key)
+        if data is not None:
+            RESULT_CACHE.put(key, data)
+    return data
+
+
+def result_cache_put(key: str, data: bytes) -> None:
+    RESULT_CACHE.put(key, data)
+    if RESULT_DISK_CACHE is not None:
+        RESULT_DISK_CACHE.put(key, data)
+
+
+# ---------------------------------------------------------------------------
+# Story segments — rendered long-form chunks, reused across re-renders
+# ---------------------------------------------------------------------------
+
+class SegmentStore:
+    """
+    Rendered long-form chunks ("segments") as float32 .npy files under
+    `segments/`, content-addressed by `segment_key`, and one manifest per
+    story under `stories/` listing the segments of its latest render in
+    order. Segments that no manifest lists any more are deleted when a
+    manifest is replaced.
+    """
+    def __init__(self, root: str):
+        self.segments_dir = os.path.join(root, "segments")
+        self.stories_dir = os.path.join(root, "stories")
+        os.makedirs(self.segments_dir, exist_ok=True)
+        os.makedirs(self.stories_dir, exist_ok=True)
+
+    def get(self, key: str) -> torch.Tensor | None:
+        try:
+            return torch.from_numpy(np.load(os.path.join(self.segments_dir, f"{key}.npy")))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, audio: torch.Tensor) -> None:
+        path = os.path.join(self.segments_dir, f"{key}.npy")
+        with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+            np.save(f, audio.float().numpy())
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def read_manifest(self, story_id: str) -> dict | None:
+        try:
+            with open(os.path.join(self.stories_dir, f"{story_id}.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_manifest(self, story_id: str, manifest: dict) -> None:
+        """Replace the story's manifest, then delete segments that only its old render used."""
+        previous = self.read_manifest(story_id)
+        path = os.path.join(self.stories_dir, f"{story_id}.json")
+        with open(f"{path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+        dropped = {s["key"] for s in (previous or {}).get("segments", [])} - {s["key"] for s in manifest["segments"]}
+        if dropped:
+            for name in os.listdir(self.stories_dir):
+                if name.endswith(".json") and name != f"{story_id}.json":
+                    other = self.read_manifest(name[:-len(".json")]) or {}
+                    dropped -= {s["key"] for s in other.get("segments", [])}
+            for key in dropped:
+                try:
+                    os.remove(os.path.join(self.segments_dir, f"{key}.npy"))
+                except OSError:
+                    pass
+            logger.info(f"Story '{story_id}': deleted {len(dropped)} segment(s) no longer used")
+
+
+SEGMENT_STORE = SegmentStore(SEGMENT_STORE_DIR) if SEGMENT_STORE_DIR else None
+
+
+def normalize_segment_text(text: str) -> str:
+    """Text as it affects the audio: Unicode NFC, whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def segment_key(params: JobParams, i: int) -> str:
+    """Content address of chunk i's rendered audio (before stitching)."""
+    payload = {
+        "model": MODEL_ID,
+        "text": normalize_segment_text(params.input_texts[i]),  # includes the voice transcript
+        "audio_prompt": params.audio_prompt_hash,
+        "max_new_tokens": params.token_budgets[i] if params.token_budgets is not None else params.max_new_tokens,
+        "guidance_scale": params.guidance_scale,
+        "temperature": params.temperature,
+        "top_p": params.top_p,
+        "top_k": params.top_k,
+        "seed": params.seeds[i] if params.seeds is not None else None,
+        "trim_silence": params.trim_silence,
+        "target_lufs": params.target_lufs,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Audio delivery — inline base64 or S3-compatible object storage
+# ---------------------------------------------------------------------------
+
+_CONTENT_TYPES = {
+    "wav": "audio/wav",
+    "mp3": "audio/mpeg",
+    "flac": "audio/flac",
+    "opus": "audio/ogg",
+    "pcm": "application/octet-stream",
+}
+
+
+@lru_cache(maxsize=1)
+def _s3():
+    """S3 client and transfer config, created on first upload (boto3 is optional)."""
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+
+    client = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL or None)
+    # Clips above 8 MB go up as multipart uploads with concurrent parts
+    transfer = TransferConfig(multipart_threshold=8 * 2**20, multipart_chunksize=8 * 2**20, max_concurrency=4)
+    return client, transfer
+
+
+def upload_clip(data: bytes, fmt: str) -> str:
+    """Upload one encoded clip and return its object key (content-addressed, so re-uploads are idempotent)."""
+    client, transfer = _s3()
+    key = f"{S3_PREFIX}{hashlib.sha256(data).hexdigest()}.{fmt}"
+    client.upload_fileobj(
+        io.BytesIO(data), S3_BUCKET, key,
+        ExtraArgs={"ContentType": _CONTENT_TYPES[fmt]},
+        Config=transfer,
+    )
+    return key
+
+
+def deliver(data: bytes, params: JobParams) -> str:
+    """The entry for one clip in the response's "audio" list: base64, an object key or a presigned URL."""
+    if params.delivery == "inline":
+        return base64.b64encode(data).decode("utf-8")
+    try:
+        key = upload_clip(data, params.output_format)
+        if params.delivery == "key":
+            return key
+        client, _ = _s3()
+        return client.generate_presigned_url(
+            "get_object", Params={"Bucket": S3_BUCKET, "Key": key}, ExpiresIn=S3_URL_EXPIRY_S
+        )
+    except Exception as e:
+        logger.error(f"Upload to s3://{S3_BUCKET}/{S3_PREFIX} failed: {e}", exc_info=True)
+        raise AppError("UPLOAD_FAILED", f"Failed to upload audio: {e}")
+
+
 # ---------------------------------------------------------------------------
 # Generation
 # ---------------------------------------------------------------------------
@@ -421,6 +1835,74 @@ def temporary_seed(seed: int | None):
         torch.backends.cudnn.benchmark = prev_benchmark
 
 
+class PerItemSamplingLogitsProcessor(LogitsProcessor):
+    """
+    Samples every sequence's next tokens (one per codebook channel) from its
+    own seeded torch.Generator and collapses the scores to that choice, so
+    the sampling step in `generate` that follows just picks it. An item's
+    draws then depend on its own seed only, not on its batch partners.
+
+    Sampling is by inverse CDF: each step draws one uniform per channel from
+    every distinct seed's generator, and the whole batch is then sampled in
+    one vectorised search. Items that share a seed (e.g. a job-level "seed")
+    share a generator, since theirs would draw the same uniforms anyway.
+
+    Must run last: after guidance and the warpers, and after Dia's EOS/delay
+    processor, which needs the unsampled scores for its EOS check.
+    """
+    VERSION = 3  # part of the result cache key: bump when seeded renders change
+
+    def __init__(self, seeds: list[int], num_channels: int, device: str):
+        unique = sorted(set(seeds))
+        self.generators = [torch.Generator(device=device).manual_seed(s) for s in unique]
+        self.item_generator = torch.tensor([unique.index(s) for s in seeds], device=device)
+        self.num_channels = num_channels
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        uniforms = torch.stack([
+            torch.rand(self.num_channels, generator=g, device=scores.device)
+            for g in self.generators
+        ])
+        u = uniforms[self.item_generator].reshape(-1, 1)
+        cdf = scores.softmax(dim=-1).cumsum(dim=-1)
+        # "right": the first token whose cumulative probability exceeds the draw, never a zero-probability one
+        tokens = torch.searchsorted(cdf, u * cdf[:, -1:], right=True).clamp_(max=scores.shape[-1] - 1)
+        return torch.full_like(scores, -float("inf")).scatter_(1, tokens, 0.0)
+
+
+@contextmanager
+def per_item_processors(seeds: list[int] | None, budgets: list[int] | None):
+    """
+    Within the block, `model.generate` samples each batch item from its own
+    seed (see PerItemSamplingLogitsProcessor) and ends items that reach their
+    token budget (see TokenBudgetLogitsProcessor). Dia builds its processor
+    list itself and ignores a `logits_processor` argument, so these are
+    added by wrapping `model._get_logits_processor`.
+    """
+    if seeds is None and budgets is None:
+        yield
+        return
+
+    build_processors = model._get_logits_processor
+    num_channels = len(model.config.delay_pattern)
+
+    def _get_logits_processor(*args, **kwargs):
+        processors = build_processors(*args, **kwargs)
+        if budgets is not None:
+            # Before Dia's EOS/delay processor (always last), which reacts to the forced EOS
+            eos_token_id = model.config.decoder_config.eos_token_id
+            processors.insert(len(processors) - 1, TokenBudgetLogitsProcessor(budgets, num_channels, eos_token_id))
+        if seeds is not None and kwargs["generation_config"].do_sample:
+            processors.append(PerItemSamplingLogitsProcessor(seeds, num_channels, DEVICE))
+        return processors
+
+    model._get_logits_processor = _get_logits_processor
+    try:
+        yield
+    finally:
+        del model._get_logits_processor
+
+
 def log_settings(params: JobParams, audio_prompt_len: int | None) -> None:
     """Log generation settings as a JSON blob with full prompt texts."""
     mode = "voice_clone" if params.is_voice_cloning else "tts"
@@ -438,6 +1920,17 @@ def log_settings(params: JobParams, audio_prompt_len: int | None) -> None:
         "seed": params.seed,
         "output_format": params.output_format,
     }
+    if params.seeds is not None and params.seed is None:
+        settings["seeds"] = params.seeds
+    if params.trim_silence:
+        settings["trim_silence"] = True
+    if params.target_lufs is not None:
+        settings["target_lufs"] = params.target_lufs
+    if params.priority != "normal":
+        settings["priority"] = params.priority
+    if params.token_budgets is not None:
+        settings["max_new_tokens"] = "auto"
+        settings["token_budgets"] = params.token_budgets
     if params.voice:
         settings["voice"] = params.voice
     if params.audio_prompt_b64 and not params.voice:
@@ -448,31 +1941,118 @@ def log_settings(params: JobParams, audio_prompt_len: int | None) -> None:
     logger.info(f"Settings: {json.dumps(settings)}")
 
 
-def generate_speech(params: JobParams) -> list[str]:
+def _prepare_inputs(params: JobParams, texts: list[str]):
+    """Tokenise a sub-batch and attach the shared audio prompt (if any)."""
+    inputs = processor(text=texts, padding=True, return_tensors="pt").to(DEVICE)
+    if params.is_voice_cloning and params.audio_codes is not None:
+        # Reuse the voice's cached decoder prompt instead of re-encoding the audio per text
+        inputs.update(decoder_prompt(params.audio_codes, params.audio_prompt_hash).for_batch(len(texts)))
+    return inputs
+
+
+def _run_batches(params: JobParams, batches: list[list[int]], generate_kwargs: dict, audio_prompt_len: int | None):
     """
-    Run the TTS/voice-cloning pipeline and return a list of base64-encoded
-    audio strings. Raises AppError on failure.
+    Run sub-batches one after another, yielding (indices, audio clips, decoder
+    steps used per item, padded decoder length) for each finished one.
+
+    A sub-batch that runs out of GPU memory is bisected and retried after
+    clearing the cache. A single item that still doesn't fit is recorded in
+    `params.item_errors` instead of failing the whole job.
+
+    Before each sub-batch, queued jobs of a more urgent priority class run
+    first (see `BatchQueue.preempt`).
     """
-    # ── Prepare processor inputs ────────────────────────────────
-    audio_prompt_len = None
+    texts = params.input_texts
+    pending = list(reversed(batches))
+    max_delay = max(_AUDIO_KWARGS["delay_pattern"])
+
+    while pending:
+        BATCH_QUEUE.preempt(params)
+        batch = pending.pop()
+        inputs = outputs = None
+        try:
+            with params.metrics.stage("tokenize"):
+                inputs = _prepare_inputs(params, [texts[i] for i in batch])
+            seeds = [params.seeds[i] for i in batch] if params.seeds is not None else None
+            budgets = [params.token_budgets[i] for i in batch] if params.token_budgets is not None else None
+            if budgets is not None:
+                # Room for the largest budget's forced EOS and the delay flush after it: every item
+                # is then ended by its own budget, never earlier by Dia's length limit, so a seeded
+                # clip doesn't depend on the budgets of its batch partners
+                generate_kwargs = {**generate_kwargs, "max_new_tokens": max(budgets) + max_delay + 1}
+            with params.metrics.stage("generate"), torch.no_grad(), per_item_processors(seeds, budgets):
+                outputs = model.generate(**inputs, **generate_kwargs)
+            with params.metrics.stage("batch_decode"):
+                decoded = processor.batch_decode(outputs, audio_prompt_len=audio_prompt_len)
+        except torch.cuda.OutOfMemoryError:
+            oom = True
+        else:
+            oom = False
+
+        if oom:
+            # Handled outside the except block so the failed tensors can be freed
+            inputs = outputs = None
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+            if len(batch) == 1:
+                logger.error(f"GPU out of memory on text[{batch[0]}] even on its own")
+                params.item_errors[batch[0]] = AppError(
+                    "GPU_OOM", "GPU out of memory. Try reducing text length or max_new_tokens."
+                )
+                continue
+
+            mid = len(batch) // 2
+            logger.warning(f"GPU out of memory on a sub-batch of {len(batch)}, retrying as {mid} + {len(batch) - mid}")
+            pending.append(batch[mid:])
+            pending.append(batch[:mid])
+            continue
 
-    if params.is_voice_cloning and params.audio_array is not None:
-        audio = params.audio_array
-        audio_batch = [audio] * len(params.input_texts) if len(params.input_texts) > 1 else audio
-
-        inputs = processor(
-            text=params.input_texts,
-            audio=audio_batch,
-            padding=True,
-            return_tensors="pt",
-        ).to(DEVICE)
-        audio_prompt_len = processor.get_audio_prompt_len(inputs["decoder_attention_mask"])
+        lengths = generated_lengths(outputs)
+        # Decoder steps beyond the prompt (BOS, plus the audio prompt when cloning)
+        prompt_steps = inputs["decoder_input_ids"].shape[1] if "decoder_input_ids" in inputs else 1
+        tokens = [max(n - prompt_steps, 0) for n in lengths]
+        params.metrics.item_tokens.update(zip(batch, tokens))
+        # Ended on its own: EOS came before its budget, or before Dia's length limit (which forces
+        # EOS after max_new_tokens - max_delay - 1 steps so the delayed channels can flush). The
+        # longest item always fills the batch, so the output length can't tell. `tokens` counts
+        # the EOS step itself (the flush is already excluded), so t - 1 steps came before it.
+        limits = budgets or [generate_kwargs["max_new_tokens"] - max_delay - 1] * len(batch)
+        eos = [t - 1 < limit for t, limit in zip(tokens, limits)]
+        log_generations(params, batch, tokens, eos)
+        params.metrics.item_audio_s.update((i, len(audio) / SAMPLE_RATE) for i, audio in zip(batch, decoded))
+
+        yield batch, decoded, lengths, outputs.shape[1]
+
+
+def synthesize(params: JobParams, indices: list[int] | None = None) -> Iterator[tuple[list[int], list[torch.Tensor]]]:
+    """
+    Run the TTS/voice-cloning pipeline over `indices` (default: every text),
+    yielding (indices, audio clips) as each sub-batch finishes. Raises AppError
+    on failure.
+
+    Texts are split into length-bucketed sub-batches (see `plan_batches`) that
+    also fit the memory budget, and run one after another, shortest first.
+    Items that can't fit in memory on their own are never yielded; their
+    error is recorded in `params.item_errors`.
+    """
+    texts = params.input_texts
+    if indices is None:
+        indices = list(range(len(texts)))
+
+    # ── Audio prompt length (shared by every sub-batch) ─────────
+    audio_prompt_len = None
+    if params.is_voice_cloning and params.audio_codes is not None:
+        audio_prompt_len = decoder_prompt(params.audio_codes, params.audio_prompt_hash).audio_prompt_len
         logger.debug(f"Audio prompt len (tokens): {audio_prompt_len}")
-    else:
-        inputs = processor(text=params.input_texts, padding=True, return_tensors="pt").to(DEVICE)
+
+    batches = plan_batches([texts[i] for i in indices], MAX_BATCH_ITEMS, MAX_BATCH_TOKENS)
+    batches = [[indices[j] for j in batch] for batch in batches]
+    batches = fit_batches_to_memory(params, batches, audio_prompt_len or 1)
 
     # ── Log ─────────────────────────────────────────────────────
     log_settings(params, audio_prompt_len)
+    logger.info(f"Scheduled {len(indices)} text(s) into {len(batches)} sub-batch(es): {[len(b) for b in batches]}")
 
     # ── Generate ────────────────────────────────────────────────
     generate_kwargs = {
@@ -483,21 +2063,171 @@ def generate_speech(params: JobParams) -> list[str]:
         "top_k": params.top_k,
     }
 
-    try:
-        with temporary_seed(params.seed):
-            with torch.no_grad():
-                outputs = model.generate(**inputs, **generate_kwargs)
+    used_steps: dict[int, int] = {}
+    bucketed_waste = 0
 
-        audio_list = processor.batch_decode(outputs, audio_prompt_len=audio_prompt_len)
-    except torch.cuda.OutOfMemoryError:
-        logger.error("GPU out of memory")
-        raise AppError("GPU_OOM", "GPU out of memory. Try reducing batch size or text length.")
+    try:
+        # Items sample from their own seeds; the global seed covers everything else
+        with temporary_seed(params.seeds[0] if params.seeds else None):
+            for batch, decoded, lengths, padded_len in _run_batches(params, batches, generate_kwargs, audio_prompt_len):
+                bucketed_waste += sum(padded_len - n for n in lengths)
+                used_steps.update(zip(batch, lengths))
+                if params.trim_silence or params.target_lufs is not None:
+                    with params.metrics.stage("postprocess"):
+                        decoded = postprocess_clips(decoded, SAMPLE_RATE, params.trim_silence, params.target_lufs)
+                    params.metrics.item_audio_s.update((i, len(audio) / SAMPLE_RATE) for i, audio in zip(batch, decoded))
+                yield batch, decoded
     except Exception as e:
         logger.error(f"Generation failed: {e}", exc_info=True)
         raise AppError("GENERATION_FAILED", f"Generation failed: {e}")
 
-    # ── Encode to base64 ────────────────────────────────────────
-    return [tensor_to_base64(a, SAMPLE_RATE, fmt=params.output_format) for a in audio_list]
+    if len(params.item_errors) == len(indices):
+        raise next(iter(params.item_errors.values()))
+
+    # ── Padding waste: what a single batch would have spent vs. buckets ──
+    longest = max(used_steps.values())
+    single_batch_waste = sum(longest - n for n in used_steps.values())
+    PADDING_WASTE_TOKENS["bucketed"] += bucketed_waste
+    PADDING_WASTE_TOKENS["single_batch"] += single_batch_waste
+    logger.info(
+        f"Padding waste: {bucketed_waste} decoder steps (single batch: {single_batch_waste}); "
+        f"cumulative: {json.dumps(PADDING_WASTE_TOKENS)}"
+    )
+
+
+
+ENCODE_EXECUTOR = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encode")
+
+
+def _encode_clip(audio: torch.Tensor, params: JobParams) -> tuple[bytes, str, dict[str, float]]:
+    """
+    Encode and deliver one clip (runs on ENCODE_EXECUTOR). Returns the file
+    bytes, the response entry (see `deliver`) and the seconds spent per stage.
+    """
+    start = time.perf_counter()
+    data = encode_audio(audio, SAMPLE_RATE, fmt=params.output_format)
+    encoded = time.perf_counter()
+    entry = deliver(data, params)
+    return data, entry, {"encode": encoded - start, "deliver": time.perf_counter() - encoded}
+
+
+def _deliver_cached(data: bytes, params: JobParams) -> tuple[bytes, str, dict[str, float]]:
+    start = time.perf_counter()
+    return data, deliver(data, params), {"deliver": time.perf_counter() - start}
+
+
+def iter_results(params: JobParams) -> Iterator[tuple[int, str]]:
+    """
+    Yield (index, audio entry) per text — base64, or an S3 key/URL, see
+    `deliver` — result-cache hits first, then the misses as their
+    sub-batches finish. Only misses reach `model.generate`; their clips are
+    encoded and delivered on ENCODE_EXECUTOR while later sub-batches run,
+    except when streaming: then each sub-batch's clips are yielded before
+    the next one starts. The indices of hits are recorded in `params.cached_items`.
+    """
+    use_cache = result_cache_enabled(params)
+    keys = [result_cache_key(params, i) if use_cache else None for i in range(len(params.input_texts))]
+    pending: deque[tuple[int, Future]] = deque()
+    misses = []
+    for i, key in enumerate(keys):
+        data = result_cache_get(key) if key else None
+        if data is None:
+            misses.append(i)
+        else:
+            pending.append((i, ENCODE_EXECUTOR.submit(_deliver_cached, data, params)))
+
+    params.cached_items = set(range(len(keys))) - set(misses)
+    if use_cache:
+        logger.info(f"Result cache: {len(params.cached_items)} hit(s), {len(misses)} miss(es)")
+
+    def finish(i: int, future: Future) -> tuple[int, str]:
+        data, entry, seconds = future.result()
+        for stage, t in seconds.items():
+            params.metrics.add(stage, t)
+        if keys[i] and i not in params.cached_items:
+            result_cache_put(keys[i], data)
+        return i, entry
+
+    while pending:
+        yield finish(*pending.popleft())
+    if not misses:
+        return
+
+    for batch, clips in synthesize(params, misses):
+        for i, audio in zip(batch, clips):
+            pending.append((i, ENCODE_EXECUTOR.submit(_encode_clip, audio, params)))
+        # Hand over what's done; the rest keeps encoding while the next sub-batch generates.
+        # Streamed clips are waited for, so they go out before the next sub-batch starts.
+        while pending and (params.stream or pending[0][1].done()):
+            yield finish(*pending.popleft())
+
+    while pending:
+        yield finish(*pending.popleft())
+
+
+def generate_speech(params: JobParams) -> list[str | None]:
+    """
+    Run the pipeline and return the audio entries (base64, or S3 keys/URLs,
+    see `deliver`) in input order. Items that failed (see `params.item_errors`)
+    are None.
+    """
+    result: list[str | None] = [None] * len(params.input_texts)
+    for i, entry in iter_results(params):
+        result[i] = entry
+    return result
+
+
+def render_long_form(params: JobParams) -> torch.Tensor:
+    """
+    Generate every chunk of a long-form job in batched sub-batches and stitch
+    them back together, in order, into a single waveform.
+
+    With a `story_id` and SEGMENT_STORE_DIR, chunks whose text, voice and
+    settings match an already rendered segment are reused (recorded in
+    `params.cached_items`), only the rest are generated, and the story's
+    manifest is updated to the new list of segments.
+    """
+    plan = params.long_form
+    if not params.is_voice_cloning:
+        logger.warning("long_form without 'voice' or 'audio_prompt': the speaker may change between chunks.")
+
+    clips: list[torch.Tensor | None] = [None] * len(params.input_texts)
+    keys = None
+    if plan.story_id and SEGMENT_STORE is None:
+        logger.warning(f"story_id '{plan.story_id}' given but SEGMENT_STORE_DIR is not set, rendering every chunk.")
+    elif plan.story_id:
+        keys = [segment_key(params, i) for i in range(len(clips))]
+        with params.metrics.stage("load_segments"):
+            clips = [SEGMENT_STORE.get(key) for key in keys]
+        params.cached_items = {i for i, clip in enumerate(clips) if clip is not None}
+        logger.info(f"Story '{plan.story_id}': reusing {len(params.cached_items)} of {len(clips)} segment(s)")
+
+    todo = [i for i, clip in enumerate(clips) if clip is None]
+    if todo:
+        for batch, decoded in synthesize(params, todo):
+            for i, audio in zip(batch, decoded):
+                clips[i] = audio
+                if keys is not None:
+                    # Stored straight away, so a retry after a failed chunk only renders that one
+                    SEGMENT_STORE.put(keys[i], audio)
+
+    if params.item_errors:
+        i, error = min(params.item_errors.items())
+        raise AppError(error.code, f"Long-form chunk {i} failed: {error.message}")
+
+    if keys is not None:
+        SEGMENT_STORE.write_manifest(plan.story_id, {
+            "story_id": plan.story_id,
+            "rendered_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "segments": [
+                {"key": key, "text": chunk, "paragraph_start": starts, "samples": len(clip)}
+                for key, chunk, starts, clip in zip(keys, plan.chunks, plan.paragraph_starts, clips)
+            ],
+        })
+
+    audio = stitch_clips(clips, plan.gaps_ms(), SAMPLE_RATE, crossfade_ms=plan.crossfade_ms)
+    logger.info(f"Stitched {len(clips)} chunk(s) into {len(audio) / SAMPLE_RATE:.1f}s of audio")
+    return audio
 
 
 # ---------------------------------------------------------------------------
@@ -510,34 +2240,78 @@ def handler(job: dict) -> dict:
 
     Input schema:
         texts           (list[str])      — List of texts to synthesise.
-        max_new_tokens  (int, 3072)      — Maximum audio tokens.
+        max_new_tokens  (int|"auto", 3072) — Maximum audio tokens; "auto" predicts a budget per text.
         guidance_scale  (float, 3.0)     — Classifier-free guidance scale.
         temperature     (float, 1.8)     — Sampling temperature.
         top_p           (float, 0.90)    — Nucleus sampling.
         top_k           (int, 50)        — Top-k sampling.
         seed            (int|null)       — Random seed.
-        output_format   (str, "wav")     — Audio format (wav / mp3 / flac).
+        seeds           (list[int]|null) — One seed per text, or N seeds for a single text (N takes).
+        output_format   (str, "wav")     — Audio format (wav / mp3 / flac / opus / pcm).
+        stream          (bool, false)    — Yield clips as they finish (HANDLER_MODE=stream only).
+        delivery        (str, "inline")  — "inline" base64, or upload to S3_BUCKET and return a
+                                           presigned "url" or the object "key".
+        trim_silence    (bool, false)    — Trim leading and trailing silence from each clip.
+        target_lufs     (float|null)     — Normalise each clip's loudness to this many LUFS.
+        priority        (str, "normal")  — "interactive", "normal" or "bulk"; scheduling class
+                                           with HANDLER_MODE=batch.
+        metrics         (bool, false)    — Include per-stage timings and resource use in the response.
 
     Voice cloning — preset or custom:
         voice                     (str)  — Preset voice ID (e.g. "F1", "M1").
         audio_prompt              (str)  — Base64-encoded audio to clone from.
         audio_prompt_transcript   (str)  — Transcript of the audio prompt.
 
+    Long-form — one clip from a whole story (replaces "texts"):
+        long_form                 (bool)       — Enable long-form mode.
+        text                      (str)        — Markdown or plain text.
+        max_chunk_chars           (int, auto)  — Chunk size; defaults to ~75% of max_new_tokens.
+        silence_ms                (float, 250) — Pause between chunks of a paragraph.
+        paragraph_silence_ms      (float, 700) — Pause between paragraphs.
+        crossfade_ms              (float, 0)   — Crossfade / fade length at each join.
+        story_id                  (str)        — Reuse unchanged chunks from this story's last
+                                                 render (needs SEGMENT_STORE_DIR).
+
     Returns: { "audio": ["<b64>", ...], "format": "wav", "count": N }
+    Long-form jobs return a single clip plus "chunks": <number of chunks>, and
+    with a story_id "segments": { "reused": R, "rendered": N }.
+    Jobs with "seeds" also return "seeds" (one per clip, takes expanded).
+    Seeded jobs also return "cache": { "hits": H, "misses": M } from the result cache.
+    With "metrics": true the response also has "metrics" (see JobMetrics.summary);
+    they are logged as one "Metrics: {...}" JSON line for every job either way.
+    Items that could not be generated are null in "audio" and listed in
+    "errors": [{ "index": i, "error": "...", "code": "..." }, ...].
     """
+    started = time.perf_counter()
+    reset_peak_memory()
     try:
         # 1. Parse input
-        params = parse_input(job["input"])
+        metrics = JobMetrics()
+        with metrics.stage("parse_input"):
+            params = parse_input(job["input"])
+        params.metrics = metrics
 
         # 2. Resolve voice cloning (if requested)
-        resolve_voice_cloning(params)
+        with metrics.stage("resolve_voice_cloning"):
+            resolve_voice_cloning(params)
 
         # 3. Generate speech
-        result = generate_speech(params)
+        if params.long_form:
+            audio = render_long_form(params)
+            with metrics.stage("encode"):
+                data = encode_audio(audio, SAMPLE_RATE, fmt=params.output_format)
+            with metrics.stage("deliver"):
+                result = [deliver(data, params)]
+        else:
+            result = generate_speech(params)
 
         # 4. Format response
         logger.info(f"Generated {len(result)} audio clip(s)")
-        return {"audio": result, "format": params.output_format, "count": len(result)}
+        response = format_response(params, result)
+        summary = log_metrics(job, params, time.perf_counter() - started)
+        if params.return_metrics:
+            response["metrics"] = summary
+        return response
 
     except AppError as e:
         logger.error(f"AppError: [{e.code}] {e.message}")
@@ -548,4 +2322,615 @@ def handler(job: dict) -> dict:
         return {"error": f"Internal handler error: {str(e)}", "code": "INTERNAL_ERROR"}
 
 
-runpod.serverless.start({"handler": handler})
+def format_response(params: JobParams, result: list[str | None]) -> dict:
+    response = {"audio": result, "format": params.output_format, "count": len(result)}
+    if params.output_format == "pcm":
+        response["sample_rate"] = SAMPLE_RATE
+    if params.delivery != "inline":
+        response["delivery"] = params.delivery
+    if params.seeds is not None and params.seed is None:
+        response["seeds"] = params.seeds
+    if params.long_form:
+        response["chunks"] = len(params.long_form.chunks)
+        if params.long_form.story_id and SEGMENT_STORE is not None:
+            reused = len(params.cached_items)
+            response["segments"] = {"reused": reused, "rendered": len(params.long_form.chunks) - reused}
+    elif result_cache_enabled(params):
+        hits = len(params.cached_items)
+        response["cache"] = {"hits": hits, "misses": len(params.input_texts) - hits}
+    if params.item_errors:
+        response["errors"] = _item_errors(params)
+    return response
+
+
+def log_metrics(job: dict, params: JobParams, total_s: float) -> dict:
+    """Log the job's metrics as one JSON line and return them."""
+    summary = params.metrics.summary(total_s)
+    logger.info(f"Metrics: {json.dumps({'job_id': job.get('id'), 'items': len(params.input_texts), **summary})}")
+    return summary
+
+
+def _item_errors(params: JobParams) -> list[dict]:
+    return [
+        {"index": i, "error": e.message, "code": e.code}
+        for i, e in sorted(params.item_errors.items())
+    ]
+
+
+def stream_handler(job: dict) -> Iterator[dict]:
+    """
+    Generator variant of `handler`, registered when HANDLER_MODE=stream.
+
+    With "stream": true in the input, every clip is yielded as soon as its
+    sub-batch has been decoded and encoded:
+        { "index": i, "audio": "<b64>", "format": "wav" }
+    plus "seed" when the job is seeded. With "metrics": true the last chunk
+    is { "metrics": {...} }. Items that failed are yielded as { "index": i, "error": "...", "code": "..." }.
+
+    Without the flag (or for long-form jobs, which produce a single clip),
+    the regular `handler` response is yielded as a single chunk.
+    """
+    if not job["input"].get("stream") or job["input"].get("long_form"):
+        yield handler(job)
+        return
+
+    started = time.perf_counter()
+    reset_peak_memory()
+    try:
+        metrics = JobMetrics()
+        with metrics.stage("parse_input"):
+            params = parse_input(job["input"])
+        params.metrics = metrics
+        with metrics.stage("resolve_voice_cloning"):
+            resolve_voice_cloning(params)
+
+        count = 0
+        for i, entry in iter_results(params):
+            chunk = {"index": i, "audio": entry, "format": params.output_format}
+            if params.output_format == "pcm":
+                chunk["sample_rate"] = SAMPLE_RATE
+            if params.seeds is not None:
+                chunk["seed"] = params.seeds[i]
+            yield chunk
+            count += 1
+
+        yield from _item_errors(params)
+        logger.info(f"Streamed {count} audio clip(s)")
+        summary = log_metrics(job, params, time.perf_counter() - started)
+        if params.return_metrics:
+            yield {"metrics": summary}
+
+    except AppError as e:
+        logger.error(f"AppError: [{e.code}] {e.message}")
+        yield {"error": e.message, "code": e.code}
+
+    except Exception as e:
+        logger.critical(f"Unhandled exception in stream handler: {e}", exc_info=True)
+        yield {"error": f"Internal handler error: {str(e)}", "code": "INTERNAL_ERROR"}
+
+
+# ---------------------------------------------------------------------------
+# Cross-job batching and scheduling (HANDLER_MODE=batch)
+# ---------------------------------------------------------------------------
+
+# Single thread for everything that touches the GPU, so the event loop stays free
+GPU_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu")
+
+
+def batch_key(params: JobParams) -> tuple:
+    """Jobs with equal keys can share a `model.generate` call."""
+    return (
+        "auto" if params.token_budgets is not None else params.max_new_tokens,
+        params.guidance_scale,
+        params.temperature,
+        params.top_p,
+        params.top_k,
+        params.output_format,
+        params.delivery,
+        params.trim_silence,
+        params.target_lufs,
+        params.audio_prompt_hash,  # the audio prompt is shared by the whole batch
+        params.seeds is not None,
+    )
+
+
+def merge_jobs(jobs: list[JobParams]) -> JobParams:
+    """One JobParams holding the texts (and seeds) of compatible jobs, in order."""
+    return replace(
+        jobs[0],
+        input_texts=[t for p in jobs for t in p.input_texts],
+        max_new_tokens=max(p.max_new_tokens for p in jobs),
+        token_budgets=[b for p in jobs for b in p.token_budgets] if jobs[0].token_budgets is not None else None,
+        text_features=[f for p in jobs for f in p.text_features],
+        seeds=[s for p in jobs for s in p.seeds] if jobs[0].seeds is not None else None,
+        item_errors={},
+        cached_items=set(),
+        metrics=JobMetrics(),
+    )
+
+
+def estimate_job_cost(params: JobParams) -> int:
+    """
+    Decoder steps a job is expected to take: each text's predicted length
+    (see `TokenBudgetModel`), capped at its max_new_tokens budget.
+    """
+    limits = params.token_budgets or [params.max_new_tokens] * len(params.text_features)
+    return sum(
+        min(limit, math.ceil(TOKEN_BUDGET_MODEL.predict(features)))
+        for features, limit in zip(params.text_features, limits)
+    )
+
+
+@dataclass
+class QueuedJob:
+    params: JobParams
+    future: asyncio.Future
+    arrived: float
+    cost: int | None  # see estimate_job_cost; None for a step of a job that is already counted
+    call: Callable[[], object] | None = None  # runs on its own instead of merged
+
+    @property
+    def rank(self) -> int:
+        return PRIORITY_CLASSES.index(self.params.priority)
+
+
+class BatchQueue:
+    """
+    Collects jobs from concurrent handler calls and runs compatible ones
+    (see `batch_key`) as one merged job on the GPU thread. The oldest job
+    waits at most `wait_ms` for partners; every job gets back its own slice
+    of the results and errors.
+
+    Jobs run by priority class (`PRIORITY_CLASSES`), oldest first within a
+    class, and only jobs of the same class are merged. A running job checks
+    the queue before each of its sub-batches and runs any more urgent jobs
+    in between (see `preempt`), so an interactive request waits for at most
+    one sub-batch of a bulk job. With `max_queued_tokens`, non-interactive
+    jobs that would take the queue past that many estimated decoder steps
+    are turned away.
+    """
+    def __init__(self, wait_ms: float, max_items: int, max_queued_tokens: int = 0):
+        self.wait_s = wait_ms / 1000
+        self.max_items = max_items
+        self.max_queued_tokens = max_queued_tokens
+        self.preemptions = 0
+        self._pending: list[QueuedJob] = []
+        self._lock = threading.Lock()  # _pending is also taken from on the GPU thread
+        self._waits = {name: deque(maxlen=1000) for name in PRIORITY_CLASSES}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def submit(self, params: JobParams, call: Callable[[], object] | None = None):
+        """
+        Queue a job and wait for its results. With `call`, the job runs that
+        on its own instead (long-form jobs) and gets its return value.
+        """
+        return await self._enqueue(params, call, estimate_job_cost(params))
+
+    async def run(self, params: JobParams, call: Callable[[], object]):
+        """Run a step of an admitted job on the GPU thread, in turn for its priority class."""
+        return await self._enqueue(params, call, None)
+
+    async def _enqueue(self, params: JobParams, call: Callable[[], object] | None, cost: int | None):
+        self._loop = loop = asyncio.get_running_loop()
+        job = QueuedJob(params, loop.create_future(), time.monotonic(), cost, call)
+        with self._lock:
+            queued = sum(j.cost or 0 for j in self._pending)
+            # A job over the limit on its own is still admitted to an empty queue
+            if queued and job.rank > 0 and self.max_queued_tokens and queued + (cost or 0) > self.max_queued_tokens:
+                raise AppError(
+                    "QUEUE_FULL",
+                    f"Worker queue is full ({queued} estimated decoder steps queued); retry later or use priority 'interactive'.",
+                )
+            self._pending.append(job)
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+        return await job.future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            with self._lock:
+                head = min(self._pending, key=lambda j: (j.rank, j.arrived), default=None)
+                n_items = sum(len(j.params.input_texts) for j in self._pending)
+            if head is None:
+                continue  # a running job took them all in `preempt`
+            delay = head.arrived + self.wait_s - time.monotonic()
+            if delay > 0 and head.call is None and n_items < self.max_items:
+                await asyncio.sleep(delay)
+            with self._lock:
+                group = self._take_group()
+            if group:  # else a running job took them in `preempt` while we slept
+                outcome = await loop.run_in_executor(GPU_EXECUTOR, self._execute, group)
+                self._finish(group, *outcome)
+
+    def _take_group(self, below_rank: int | None = None) -> list[QueuedJob]:
+        """
+        The most urgent job (by class, then age) plus later compatible jobs
+        of its class, up to max_items texts. With `below_rank`, only jobs of
+        a more urgent class than that are considered. Call with the lock held.
+        """
+        candidates = [j for j in self._pending if below_rank is None or j.rank < below_rank]
+        if not candidates:
+            return []
+        head = min(candidates, key=lambda j: (j.rank, j.arrived))
+        if head.call is not None:
+            self._pending.remove(head)
+            return [head]
+
+        key = batch_key(head.params)
+        group, rest, n_items = [], [], 0
+        for job in self._pending:
+            n = len(job.params.input_texts)
+            if (
+                job.call is None and job.rank == head.rank and batch_key(job.params) == key
+                and (not group or n_items + n <= self.max_items)
+            ):
+                group.append(job)
+                n_items += n
+            else:
+                rest.append(job)
+        self._pending = rest
+        return group
+
+    def _execute(self, group: list[QueuedJob]) -> tuple[JobParams | None, object, Exception | None]:
+        """Run a group on the GPU thread; returns (merged params, result, error)."""
+        started = time.monotonic()
+        for job in group:
+            job.params.metrics.add("queue_wait", started - job.arrived)
+        if group[0].cost is not None:
+            for job in group:
+                self._waits[job.params.priority].append(started - job.arrived)
+            logger.info(f"Queue: {json.dumps(self.stats())}")
+
+        if group[0].call is not None:
+            merged = None
+            run = group[0].call
+        else:
+            merged = merge_jobs([job.params for job in group])
+            if len(group) > 1:
+                logger.info(f"Merged {len(group)} jobs into one batch of {len(merged.input_texts)} text(s)")
+            run = lambda: generate_speech(merged)
+        try:
+            return merged, run(), None
+        except Exception as e:
+            return merged, None, e
+
+    def preempt(self, params: JobParams) -> None:
+        """
+        Called on the GPU thread between a job's sub-batches: run every
+        queued job of a more urgent class than `params.priority` first. Their
+        results are handed back to the event loop as they finish.
+        """
+        if self._loop is None:
+            return  # nothing was ever queued (HANDLER_MODE isn't batch)
+        rank = PRIORITY_CLASSES.index(params.priority)
+        started = time.perf_counter()
+        preempted = False
+        while True:
+            with self._lock:
+                group = self._take_group(below_rank=rank)
+            if not group:
+                break
+            self.preemptions += 1
+            preempted = True
+            logger.info(f"Preempting a {params.priority} job for {len(group)} {group[0].params.priority} job(s)")
+            outcome = self._execute(group)
+            self._loop.call_soon_threadsafe(self._finish, group, *outcome)
+        if preempted:
+            params.metrics.add("preempted", time.perf_counter() - started)
+
+    def _finish(self, group: list[QueuedJob], merged: JobParams | None, result, error: Exception | None) -> None:
+        """Hand every job in a finished group its results (runs on the event loop)."""
+        if error is not None:
+            for job in group:
+                if not job.future.done():
+                    job.future.set_exception(error)
+            return
+        if merged is None:
+            if not group[0].future.done():
+                group[0].future.set_result(result)
+            return
+
+        offset = 0
+        for job in group:
+            n = len(job.params.input_texts)
+            job.params.item_errors = {
+                i - offset: e for i, e in merged.item_errors.items() if offset <= i < offset + n
+            }
+            job.params.cached_items = {i - offset for i in merged.cached_items if offset <= i < offset + n}
+            # Stage times are shared by the merged jobs; token and audio counts are per item
+            job.params.metrics.stages.update(merged.metrics.stages)
+            for merged_items, items in (
+                (merged.metrics.item_tokens, job.params.metrics.item_tokens),
+                (merged.metrics.item_audio_s, job.params.metrics.item_audio_s),
+            ):
+                items.update((i - offset, v) for i, v in merged_items.items() if offset <= i < offset + n)
+            if job.future.done():
+                pass
+            elif len(job.params.item_errors) == n:
+                # Like a job of its own: nothing generated fails the job
+                job.future.set_exception(job.params.item_errors[0])
+            else:
+                job.future.set_result(result[offset:offset + n])
+            offset += n
+
+    def stats(self) -> dict:
+        """Queue depth and estimated decoder steps per class, and recent queue waits."""
+        with self._lock:
+            pending = [j for j in self._pending if j.cost is not None]
+        waits = {}
+        for name, values in self._waits.items():
+            if values:
+                p50, p99 = np.percentile(list(values), [50, 99])
+                waits[name] = {"p50": round(float(p50), 3), "p99": round(float(p99), 3), "max": round(max(values), 3)}
+        return {
+            "depth": {name: sum(j.params.priority == name for j in pending) for name in PRIORITY_CLASSES},
+            "queued_tokens": {name: sum(j.cost for j in pending if j.params.priority == name) for name in PRIORITY_CLASSES},
+            "wait_s": waits,
+            "preemptions": self.preemptions,
+        }
+
+
+BATCH_QUEUE = BatchQueue(BATCH_WAIT_MS, MAX_BATCH_ITEMS, MAX_QUEUED_TOKENS)
+
+
+async def batch_handler(job: dict) -> dict:
+    """
+    Async variant of `handler`, registered when HANDLER_MODE=batch.
+
+    Up to MAX_CONCURRENCY jobs are in flight at once, so peak device memory
+    in their metrics covers the whole worker rather than a single job. Their texts go through
+    `BATCH_QUEUE`, which merges jobs with compatible generation parameters
+    into one `model.generate` call and runs them by priority class. Long-form
+    jobs run on their own, in turn. The response is the same as `handler`'s,
+    plus a "queue" snapshot (see `BatchQueue.stats`) in its metrics.
+    """
+    started = time.perf_counter()
+    try:
+        metrics = JobMetrics()
+        with metrics.stage("parse_input"):
+            params = parse_input(job["input"])
+        if params.long_form:
+            return await BATCH_QUEUE.submit(params, call=lambda: handler(job))
+        params.metrics = metrics
+
+        if params.is_voice_cloning:
+            # May encode audio on the GPU, so it takes its turn like any other step
+            with metrics.stage("resolve_voice_cloning"):
+                await BATCH_QUEUE.run(params, lambda: resolve_voice_cloning(params))
+        result = await BATCH_QUEUE.submit(params)
+
+        logger.info(f"Generated {len(result)} audio clip(s)")
+        response = format_response(params, result)
+        summary = log_metrics(job, params, time.perf_counter() - started)
+        if params.return_metrics:
+            summary["queue"] = BATCH_QUEUE.stats()
+            response["metrics"] = summary
+        return response
+
+    except AppError as e:
+        logger.error(f"AppError: [{e.code}] {e.message}")
+        return {"error": e.message, "code": e.code}
+
+    except Exception as e:
+        logger.critical(f"Unhandled exception in batch handler: {e}", exc_info=True)
+        return {"error": f"Internal handler error: {str(e)}", "code": "INTERNAL_ERROR"}
+
+
+# ---------------------------------------------------------------------------
+# Worker pool — CPU worker processes sharing one copy of the model
+# ---------------------------------------------------------------------------
+
+@dataclass
+class WorkerStats:
+    """What one pool worker has done since it started."""
+    jobs: int = 0
+    items: int = 0
+    busy_s: float = 0.0
+    generated_tokens: int = 0
+    audio_s: float = 0.0
+    restarts: int = 0
+
+    def summary(self, uptime_s: float) -> dict:
+        return {
+            "jobs": self.jobs,
+            "restarts": self.restarts,
+            "items": self.items,
+            "busy_s": round(self.busy_s, 1),
+            "utilisation": round(self.busy_s / uptime_s, 3) if uptime_s else None,
+            "tokens_per_s": round(self.generated_tokens / self.busy_s, 1) if self.busy_s else None,
+            "rtf": round(self.audio_s / self.busy_s, 3) if self.busy_s else None,
+        }
+
+
+def _pool_worker(worker_id: int, threads: int, jobs, results, current) -> None:
+    """
+    Worker process loop: run `handler` on jobs from the queue until it yields
+    None. The key of the job in progress is kept in `current[worker_id]`.
+    """
+    torch.set_num_threads(threads)
+    logger.info(f"Pool worker {worker_id} started (pid {os.getpid()}, {threads} thread(s))")
+    if WARMUP_TOKENS > 0:
+        try:
+            warmup()
+        except Exception as e:
+            logger.warning(f"Pool worker {worker_id} warmup failed, continuing without it: {e}")
+
+    while (item := jobs.get()) is not None:
+        key, job = item
+        current[worker_id] = key
+        started = time.perf_counter()
+        job_input = job.get("input")
+        wants_metrics = isinstance(job_input, dict) and bool(job_input.get("metrics"))
+        if isinstance(job_input, dict):
+            # Always collect metrics for the pool's throughput stats
+            job = {**job, "input": {**job_input, "metrics": True}}
+        try:
+            response = handler(job)
+        except BaseException as e:
+            response = {"error": f"Internal handler error: {str(e)}", "code": "INTERNAL_ERROR"}
+        summary = response.get("metrics") if wants_metrics else response.pop("metrics", None)
+        if summary is not None and wants_metrics:
+            summary["worker"] = worker_id
+        results.put((key, worker_id, response, summary, time.perf_counter() - started))
+        current[worker_id] = -1
+
+
+class WorkerPool:
+    """
+    `size` worker processes, forked from this one once the model is loaded.
+
+    The weights are memory-mapped from safetensors (or quantized to int8)
+    before the fork and never written afterwards, so every worker reads the
+    same physical pages instead of holding a copy of its own. Jobs go into
+    one queue and are taken by whichever worker is free; each worker runs the
+    regular `handler` with `threads` intra-op threads. Per-worker throughput
+    is logged after every job (see `WorkerStats`).
+
+    A worker that dies (e.g. killed for running out of memory on a long
+    story) fails the job it was running with INTERNAL_ERROR and is replaced
+    by a new fork.
+    """
+    def __init__(self, size: int, threads: int):
+        self._ctx = multiprocessing.get_context("fork")
+        self._threads = threads
+        self._jobs = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._current = self._ctx.Array("q", [-1] * size, lock=False)  # job key per worker, -1 when idle
+        self._futures: dict[int, Future] = {}
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+        self._closing = False
+        self.started = time.perf_counter()
+        self.stats = {i: WorkerStats() for i in range(size)}
+        self._workers = [self._start_worker(i) for i in range(size)]
+        # Started after the fork, so the workers don't inherit them
+        threading.Thread(target=self._collect, name="pool-results", daemon=True).start()
+        threading.Thread(target=self._monitor, name="pool-monitor", daemon=True).start()
+        logger.info(f"Worker pool: {size} process(es) x {threads} thread(s)")
+
+    def _start_worker(self, worker_id: int):
+        worker = self._ctx.Process(
+            target=_pool_worker,
+            args=(worker_id, self._threads, self._jobs, self._results, self._current),
+            name=f"tts-worker-{worker_id}",
+            daemon=True,
+        )
+        worker.start()
+        return worker
+
+    def submit(self, job: dict) -> Future:
+        future: Future = Future()
+        with self._lock:
+            key = next(self._keys)
+            self._futures[key] = future
+        self._jobs.put((key, job))
+        return future
+
+    def summary(self) -> dict:
+        uptime_s = time.perf_counter() - self.started
+        with self._lock:
+            return {f"worker_{i}": stats.summary(uptime_s) for i, stats in self.stats.items()}
+
+    def close(self) -> None:
+        self._closing = True
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _collect(self) -> None:
+        while True:
+            key, worker_id, response, summary, busy_s = self._results.get()
+            with self._lock:
+                future = self._futures.pop(key, None)
+                if future is None:
+                    continue  # its worker died after sending it, and the job was already failed
+                stats = self.stats[worker_id]
+                stats.jobs += 1
+                stats.busy_s += busy_s
+                stats.items += response.get("count", 0)
+                if summary is not None:
+                    stats.generated_tokens += summary["generated_tokens"]
+                    stats.audio_s += summary["audio_s"]
+            logger.info(f"Pool: {json.dumps(self.summary())}")
+            future.set_result(response)
+
+    def _monitor(self) -> None:
+        """Fail the job of any worker that died and start a new worker in its place."""
+        while not self._closing:
+            time.sleep(1.0)
+            for worker_id, worker in enumerate(self._workers):
+                if worker.is_alive() or self._closing:
+                    continue
+                key = self._current[worker_id]
+                self._current[worker_id] = -1
+                logger.error(f"Pool worker {worker_id} died (exit code {worker.exitcode}), restarting it")
+                with self._lock:
+                    future = self._futures.pop(key, None)
+                    self.stats[worker_id].restarts += 1
+                if future is not None:
+                    future.set_result({
+                        "error": f"Worker process died (exit code {worker.exitcode}) while running this job.",
+                        "code": "INTERNAL_ERROR",
+                    })
+                self._workers[worker_id] = self._start_worker(worker_id)
+
+
+WORKER_POOL: WorkerPool | None = None  # started by __main__ with HANDLER_MODE=pool
+
+
+async def pool_handler(job: dict) -> dict:
+    """
+    Async variant of `handler`, registered when HANDLER_MODE=pool. Up to
+    POOL_WORKERS jobs are in flight at once, each on its own worker process.
+    The response is the same as `handler`'s; with "metrics": true the
+    metrics also name the "worker" that ran the job.
+    """
+    return await asyncio.wrap_future(WORKER_POOL.submit(job))
+
+
+# ---------------------------------------------------------------------------
+# Startup
+# ---------------------------------------------------------------------------
+
+def warmup() -> None:
+    """
+    Run one short generation through the full pipeline, so the first job
+    doesn't pay for CUDA kernel selection and allocator growth.
+    """
+    params = parse_input({
+        "texts": ["[S1] hallo, dit is een test."],
+        "max_new_tokens": WARMUP_TOKENS,
+        "voice": next(iter(VOICE_STORE.ids()), None),
+    })
+    resolve_voice_cloning(params)
+    generate_speech(params)
+
+
+if __name__ == "__main__":
+    if HANDLER_MODE == "pool":
+        if DEVICE != "cpu":
+            raise ValueError("HANDLER_MODE=pool forks CPU workers and can't be used with a GPU")
+        # Workers warm up on their own: a model that already ran here would
+        # leave thread pools behind that the forked workers can't use
+        with startup_phase("worker_pool"):
+            WORKER_POOL = WorkerPool(POOL_WORKERS, cpu_threads())
+    elif WARMUP_TOKENS > 0:
+        try:
+            with startup_phase("warmup"):
+                warmup()
+        except Exception as e:
+            logger.warning(f"Warmup failed, continuing without it: {e}")
+
+    logger.info(f"Startup finished in {time.perf_counter() - STARTUP_STARTED:.2f}s: {json.dumps(STARTUP_TIMINGS)}")
+
+    if HANDLER_MODE == "stream":
+        runpod.serverless.start({"handler": stream_handler, "return_aggregate_stream": True})
+    elif HANDLER_MODE == "batch":
+        runpod.serverless.start({"handler": batch_handler, "concurrency_modifier": lambda current: MAX_CONCURRENCY})
+    elif HANDLER_MODE == "pool":
+        runpod.serverless.start({"handler": pool_handler, "concurrency_modifier": lambda current: POOL_WORKERS})
+    else:
+        runpod.serverless.start({"handler": handler})